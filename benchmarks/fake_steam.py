@@ -0,0 +1,161 @@
+"""
+Локальные заглушки steam для бенчмарков: http-сервер (GetAppList, appdetails, страницы приложений)
+и клиент с get_product_info. Данные генерируются детерминированно по id приложения
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+GENRES_COUNT = 30
+CATEGORIES_COUNT = 60
+TAGS_COUNT = 450
+
+
+def get_app_ids(apps_count: int) -> list[int]:
+    return [10 * i for i in range(1, apps_count + 1)]
+
+
+def get_app_details(app_id: int) -> dict:
+    rnd = random.Random(app_id)
+    if rnd.random() < 0.1:
+        return {"success": False}
+    is_free = rnd.random() < 0.15
+    data = {
+        "steam_appid": app_id,
+        "name": "App " + str(app_id),
+        "is_free": is_free,
+        "genres": [{"id": str(genre_id), "description": "Genre " + str(genre_id)}
+                   for genre_id in rnd.sample(range(1, GENRES_COUNT + 1), rnd.randint(0, 4))],
+        "categories": [{"id": category_id, "description": "Category " + str(category_id)}
+                       for category_id in rnd.sample(range(1, CATEGORIES_COUNT + 1), rnd.randint(0, 8))],
+    }
+    if not is_free and rnd.random() < 0.9:
+        initial = rnd.randint(1, 200) * 5000
+        discount = rnd.choice([0, 0, 0, 10, 25, 50, 75])
+        data["price_overview"] = {"currency": "RUB", "initial": initial, "final": initial * (100 - discount) // 100,
+                                  "discount_percent": discount}
+    return {"success": True, "data": data}
+
+
+def get_app_tags(app_id: int) -> list[int]:
+    rnd = random.Random(app_id * 7 + 1)
+    if rnd.random() < 0.1:
+        return []
+    return rnd.sample(range(1, TAGS_COUNT + 1), rnd.randint(3, 20))
+
+
+def get_product_info(app_id: int) -> dict:
+    tags = get_app_tags(app_id)
+    common = {"name": "App " + str(app_id)}
+    if tags:
+        common["store_tags"] = {str(order): str(tag_id) for order, tag_id in enumerate(tags)}
+    return {"appid": app_id, "common": common}
+
+
+class FakeSteamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, body: bytes, content_type: str = "application/json", status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if url.path.endswith("/ISteamApps/GetAppList/v0002/"):
+            self._send_app_list()
+        elif url.path.endswith("/api/appdetails"):
+            app_ids = [int(s_id) for s_id in query["appids"][0].split(",")]
+            filters = query.get("filters", [None])[0]
+            res = {}
+            for app_id in app_ids:
+                details = get_app_details(app_id)
+                if filters == "price_overview" and details["success"]:
+                    price = details["data"].get("price_overview")
+                    details = {"success": True, "data": {"price_overview": price} if price else []}
+                res[str(app_id)] = details
+            self._send(json.dumps(res).encode("utf-8"))
+        elif url.path.startswith("/app/"):
+            app_id = int(url.path.split("/")[2])
+            tags = [{"tagid": tag_id, "name": "Tag " + str(tag_id), "count": 1, "browseable": True}
+                    for tag_id in get_app_tags(app_id)]
+            html = ("<html><body><script type=\"text/javascript\">$J( function() { InitAppTagModal( " +
+                    str(app_id) + ", " + json.dumps(tags) + ", [], \"\", \"\", false ); });</script></body></html>")
+            self._send(html.encode("utf-8"), "text/html; charset=utf-8")
+        else:
+            self._send(b"{}", status=404)
+
+    def _send_app_list(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_chunk(text: str) -> None:
+            data = text.encode("utf-8")
+            self.wfile.write(("%x\r\n" % len(data)).encode("ascii") + data + b"\r\n")
+
+        write_chunk('{"applist":{"apps":[')
+        app_ids = get_app_ids(self.server.apps_count)
+        part = []
+        for i, app_id in enumerate(app_ids):
+            part.append(json.dumps({"appid": app_id, "name": "App " + str(app_id)}))
+            # Дубликаты, как в настоящем ответе
+            if i % 50 == 0:
+                part.append(json.dumps({"appid": app_id, "name": "App " + str(app_id)}))
+            if len(part) >= 1000:
+                write_chunk(("," if i >= len(part) else "") + ",".join(part))
+                part = []
+        if part:
+            write_chunk(("," if len(app_ids) > len(part) else "") + ",".join(part))
+        write_chunk("]}}")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_steam_server(apps_count: int, latency: float = 0, port: int = 0) -> ThreadingHTTPServer:
+    """
+    Запускает сервер-заглушку в отдельном потоке
+    :param apps_count: Количество приложений в каталоге
+    :param latency: Задержка каждого ответа в секундах
+    :return: Сервер (адрес - server.server_address)
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeSteamHandler)
+    server.daemon_threads = True
+    server.apps_count = apps_count
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, name="FakeSteam", daemon=True).start()
+    return server
+
+
+class FakeSteamClient:
+    """
+    Заглушка SteamClient: get_product_info отвечает сгенерированными метками
+    """
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.logged_on = True
+
+    def get_product_info(self, apps=(), packages=(), timeout=15, **kwargs) -> dict:
+        if self.latency:
+            self.sleep(self.latency)
+        return {"apps": {app_id: get_product_info(app_id) for app_id in apps}, "packages": {}}
+
+    def sleep(self, seconds: float) -> None:
+        import gevent
+        gevent.sleep(seconds)
+
+    def idle(self) -> None:
+        self.sleep(0)
@@ -0,0 +1,121 @@
+"""
+Временная база postgres для бенчмарков.
+Если задана переменная окружения BENCH_DSN, то используется указанная база (все таблицы в ней пересоздаются!),
+иначе в папке tmp_dir создается и запускается отдельный кластер (нужны initdb и pg_ctl,
+initdb нельзя запускать от root)
+"""
+import os
+import shutil
+import socket
+import subprocess
+
+import psycopg2
+
+from schema import migrate
+
+# Таблицы, которые пересоздаются перед бенчмарком (вместе с представлениями, которые от них зависят)
+TABLES = ["apps_store_tags", "apps_prices", "apps_genres", "apps_categories", "apps_prices_history", "crawl_progress",
+          "crawl_leases", "store_tags", "genres", "categories", "apps", "schema_version"]
+
+
+
+def _find_pg_bin(name: str) -> str:
+    path = shutil.which(name)
+    if path:
+        return path
+    try:
+        bindir = subprocess.run(["pg_config", "--bindir"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    path = os.path.join(bindir, name)
+    return path if os.path.exists(path) else None
+
+
+class TemporaryPostgres:
+    """
+    Кластер postgres во временной папке. Подключение через unix-сокет в этой же папке
+    """
+
+    def __init__(self, tmp_dir: str):
+        self.data_dir = os.path.join(tmp_dir, "pgdata")
+        self.socket_dir = tmp_dir
+        self.port = None
+        self._pg_ctl = None
+
+    def start(self) -> dict:
+        initdb = _find_pg_bin("initdb")
+        self._pg_ctl = _find_pg_bin("pg_ctl")
+        if initdb is None or self._pg_ctl is None:
+            raise RuntimeError("initdb/pg_ctl не найдены. Укажите существующую базу в переменной BENCH_DSN")
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+
+        subprocess.run([initdb, "-D", self.data_dir, "-A", "trust", "-U", "postgres", "-E", "UTF8", "--no-sync"],
+                       check=True, capture_output=True)
+        options = "-p " + str(self.port) + " -k " + self.socket_dir + " -c listen_addresses='' -c fsync=off"
+        log_filename = os.path.join(self.socket_dir, "postgres.log")
+        # pg_stat_statements есть не во всех сборках postgres, без него количество запросов не считается
+        res = subprocess.run([self._pg_ctl, "-D", self.data_dir, "-o",
+                              options + " -c shared_preload_libraries=pg_stat_statements", "-w", "-l", log_filename,
+                              "start"], capture_output=True)
+        if res.returncode != 0:
+            subprocess.run([self._pg_ctl, "-D", self.data_dir, "-o", options, "-w", "-l", log_filename, "start"],
+                           check=True, capture_output=True)
+        return {"dbname": "postgres", "user": "postgres", "host": self.socket_dir, "port": self.port}
+
+    def stop(self) -> None:
+        if self._pg_ctl is not None:
+            subprocess.run([self._pg_ctl, "-D", self.data_dir, "-m", "immediate", "stop"], capture_output=True)
+
+
+def get_bench_db_params(tmp_dir: str):
+    """
+    :return: (параметры подключения, объект TemporaryPostgres или None)
+    """
+    dsn = os.environ.get("BENCH_DSN")
+    if dsn:
+        return psycopg2.extensions.parse_dsn(dsn), None
+    postgres = TemporaryPostgres(tmp_dir)
+    return postgres.start(), postgres
+
+
+def reset_schema(db_params: dict) -> bool:
+    """
+    Пересоздает таблицы проекта (миграциями из schema.py) и сбрасывает pg_stat_statements (если расширение доступно)
+    :return: Доступно ли pg_stat_statements
+    """
+    conn = psycopg2.connect(**db_params)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    for table in TABLES:
+        cursor.execute("DROP TABLE IF EXISTS " + table + " CASCADE")
+    conn.autocommit = False
+    migrate(conn)
+    conn.autocommit = True
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_stat_statements")
+        cursor.execute("SELECT pg_stat_statements_reset()")
+        has_stat_statements = True
+    except psycopg2.Error:
+        has_stat_statements = False
+    cursor.close()
+    conn.close()
+    return has_stat_statements
+
+
+def get_statements_count(db_params: dict) -> int:
+    """
+    :return: Количество выполненных запросов по pg_stat_statements (без служебных запросов бенчмарка)
+    """
+    conn = psycopg2.connect(**db_params)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT COALESCE(SUM(calls), 0) FROM pg_stat_statements
+        WHERE query NOT ILIKE '%pg_stat_statements%'
+    """)
+    count = int(cursor.fetchone()[0])
+    cursor.close()
+    conn.close()
+    return count
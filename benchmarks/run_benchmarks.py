@@ -0,0 +1,178 @@
+"""
+Бенчмарк загрузчиков на локальных заглушках steam (см. fake_steam.py) и временной базе postgres (см. postgres.py).
+Для каждого этапа выводит количество приложений в секунду, пиковую память и количество запросов к бд.
+
+Запуск из корня репозитория:
+    python -m benchmarks.run_benchmarks --apps 20000
+    BENCH_DSN="dbname=bench user=postgres host=localhost" python -m benchmarks.run_benchmarks --apps 200000
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_steam import start_fake_steam_server, FakeSteamClient
+from benchmarks.postgres import get_bench_db_params, reset_schema, get_statements_count
+
+
+def count_rows(db_params: dict, query: str) -> int:
+    import psycopg2
+    conn = psycopg2.connect(**db_params)
+    cursor = conn.cursor()
+    cursor.execute(query)
+    count = cursor.fetchone()[0]
+    cursor.close()
+    conn.close()
+    return count
+
+
+def check_json_stream() -> None:
+    """
+    Проверяет, что потоковый разбор json (utils.iter_json_array_items) не зависит от того, где ответ разбит на части:
+    числа и строки на границе частей не должны разделяться или склеиваться
+    """
+    from utils import iter_json_array_items
+
+    document = json.dumps({"response": {"count": 3}, "apps": [
+        1, 23, 456, -7.5e3, True, None, "a,]\"b", {"appid": 10, "name": "]["}, [1, [2]], 10 ** 12
+    ]})
+    expected = json.loads(document)["apps"]
+    for chunk_size in range(1, len(document) + 1):
+        chunks = (document[i:i + chunk_size] for i in range(0, len(document), chunk_size))
+        items = list(iter_json_array_items(chunks, "apps"))
+        if items != expected:
+            raise AssertionError("Разбор json по частям размера " + str(chunk_size) + ": " + str(items))
+
+
+def measure(name: str, func, count_func, db_params: dict, has_stat_statements: bool, trace_memory: bool) -> dict:
+    """
+    Выполняет func и замеряет время, память и количество запросов к бд
+    :param count_func: Функция, которая возвращает количество обработанных объектов (приложений, для load_tags_name - меток)
+    """
+    import metrics
+
+    statements_before = get_statements_count(db_params) if has_stat_statements else None
+    round_trips_before = metrics.get_total("db_round_trips")
+    http_before = metrics.get_total("http_requests")
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    items = count_func()
+    result = {
+        "stage": name,
+        "items": items,
+        "seconds": round(elapsed, 3),
+        "items_per_second": round(items / elapsed, 1) if elapsed > 0 else None,
+        "python_peak_mb": round(peak / 1024 ** 2, 1) if peak is not None else None,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "db_statements": (get_statements_count(db_params) - statements_before - 1) if has_stat_statements else None,
+        "db_bulk_round_trips": int(metrics.get_total("db_round_trips") - round_trips_before),
+        "http_requests": int(metrics.get_total("http_requests") - http_before),
+    }
+    return result
+
+
+def print_results(results: list) -> None:
+    columns = ["stage", "items", "seconds", "items_per_second", "python_peak_mb", "max_rss_mb", "db_statements",
+               "db_bulk_round_trips", "http_requests"]
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарк загрузчиков SteamDB на локальных заглушках steam")
+    parser.add_argument("--apps", type=int, default=20000, help="размер каталога")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа заглушек в секундах")
+    parser.add_argument("--workers", type=int, default=16, help="количество одновременных запросов appdetails")
+    parser.add_argument("--bin", type=int, default=500, help="размер пачки загрузчиков")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="замерять пиковую память python через tracemalloc (замедляет выполнение)")
+    parser.add_argument("--output", help="файл для результатов в формате json")
+    args = parser.parse_args()
+
+    # Предупреждения загрузчиков (нет цены, нет меток) в бенчмарке не нужны
+    logging.basicConfig(level=logging.ERROR)
+
+    tmp_dir = tempfile.mkdtemp(prefix="steamdb_bench_")
+    server = start_fake_steam_server(args.apps, args.latency)
+    base_url = "http://%s:%d/" % server.server_address
+
+    db_params, postgres = get_bench_db_params(tmp_dir)
+    db_config_filename = os.path.join(tmp_dir, "dbconnect.json")
+    with open(db_config_filename, "w") as f:
+        json.dump(db_params, f)
+
+    os.environ.update({
+        "STEAMDB_STORE_API_URL": base_url + "api/",
+        "STEAMDB_WEB_API_URL": base_url,
+        "STEAMDB_STORE_URL": base_url,
+        "STEAMDB_DB_CONFIG": db_config_filename,
+        "STEAMDB_APP_LIST_FILENAME": os.path.join(tmp_dir, "AppList.jsonl"),
+        "STEAMDB_RESPONSE_CACHE_FILENAME": os.path.join(tmp_dir, "response_cache.sqlite"),
+        "STEAMDB_SPILL_DIRNAME": os.path.join(tmp_dir, "spill"),
+        "STEAMDB_RATE_CONTROL_FILENAME": os.path.join(tmp_dir, "rate_control.json"),
+    })
+
+    # Модули проекта читают настройки при импорте, поэтому импортируются после настройки окружения
+    import script_funcs
+    from settings import APP_LIST_FILENAME
+    check_json_stream()
+
+    try:
+        has_stat_statements = reset_schema(db_params)
+
+        def count_app_list():
+            with open(APP_LIST_FILENAME, encoding="utf-8") as f:
+                return sum(1 for _ in f)
+
+        stages = [
+            ("save_app_list", script_funcs.save_app_list, count_app_list),
+            ("load_app_list_sql", lambda: script_funcs.load_app_list_sql(),
+             lambda: count_rows(db_params, "SELECT count(*) FROM apps")),
+            ("load_genres_categories_prices",
+             lambda: script_funcs.load_genres_categories_prices(args.bin, False, workers=args.workers,
+                                                                requests_per_second=None, use_cache=False),
+             lambda: count_rows(db_params, "SELECT count(*) FROM crawl_progress WHERE stage = 'details'")),
+            ("load_store_tags",
+             lambda: script_funcs.load_store_tags(args.bin, track_bar=False, use_cache=False, requests_per_second=None,
+                                                  client=FakeSteamClient(args.latency)),
+             lambda: count_rows(db_params, "SELECT count(*) FROM crawl_progress WHERE stage = 'tags'")),
+            ("load_tags_name", lambda: script_funcs.load_tags_name("name"),
+             lambda: count_rows(db_params, "SELECT count(*) FROM store_tags WHERE name <> ''")),
+        ]
+
+        results = []
+        for name, func, count_func in stages:
+            print("=== " + name, file=sys.stderr)
+            results.append(measure(name, func, count_func, db_params, has_stat_statements, args.trace_memory))
+
+        print_results(results)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"apps": args.apps, "latency": args.latency, "results": results}, f, indent=1)
+    finally:
+        server.shutdown()
+        if postgres is not None:
+            postgres.stop()
+        # Временная папка: кластер postgres, список приложений, кэш ответов, spill-файлы
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
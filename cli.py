@@ -0,0 +1,225 @@
+"""
+Запуск действий и сценариев из командной строки:
+
+    python cli.py list
+    python cli.py run load_details --params '{"use_leases": true}'
+    python cli.py scenario scenario.json
+
+Модуль действия импортируется только при его запуске, поэтому, например, clear_tables не загружает steam и selenium.
+В сценарии у каждого этапа указываются этапы, после которых он выполняется (after).
+Этапы, которые не зависят друг от друга, выполняются одновременно (в отдельных потоках),
+поэтому время сценария равно самой долгой цепочке зависимых этапов, а не сумме всех этапов
+"""
+import argparse
+import cProfile
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import metrics
+from settings import LOG_FILENAME, LOGGING_IS_REQUIRED, PROFILE_DIRNAME, METRICS_JSON_FILENAME
+
+# Действие: "модуль:функция"
+ACTIONS = {
+    "save_app_list":    "script_funcs:save_app_list",
+    "load_apps":        "script_funcs:load_app_list_sql",
+    "sync_apps":        "script_funcs:sync_app_list_sql",
+    "clear_tables":     "script_funcs:clear_tables",
+    "load_details":     "script_funcs:load_genres_categories_prices",
+    "load_store_tags":  "script_funcs:load_store_tags",
+    "load_tags_name":   "script_funcs:load_tags_name",
+    "refresh_prices":   "script_funcs:refresh_prices",
+    "tags_analytics":   "script_funcs:print_tags_analytics",
+    "update_schema":    "script_funcs:update_schema",
+    "export_parquet":   "script_funcs:export_parquet",
+}
+
+# Статусы этапов сценария
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+
+_profile_lock = threading.Lock()
+
+
+def get_action(name: str):
+    """
+    :param name: Название из ACTIONS или строка "модуль:функция"
+    :return: Функция действия (модуль импортируется при первом вызове)
+    """
+    target = ACTIONS.get(name, name)
+    if ":" not in target:
+        raise ValueError("Неизвестное действие: " + name)
+    module_name, func_name = target.split(":", 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def run_action(name: str, params=None, profile_name: str = None):
+    """
+    Выполняет действие
+    :param params: Список позиционных параметров или словарь именованных
+    :param profile_name: Имя файла профиля в PROFILE_DIRNAME (если профилирование включено)
+    """
+    func = get_action(name)
+    if params is None:
+        params = []
+    args, kwargs = (params, {}) if isinstance(params, list) else ([], params)
+
+    if PROFILE_DIRNAME is None:
+        return func(*args, **kwargs)
+
+    os.makedirs(PROFILE_DIRNAME, exist_ok=True)
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # С python 3.12 профилировщик может быть только один на процесс, одновременные этапы не профилируются
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.disable()
+        with _profile_lock:
+            profile.dump_stats(os.path.join(PROFILE_DIRNAME, (profile_name or name) + ".prof"))
+
+
+def get_stages_order(stages: dict) -> list:
+    """
+    Проверяет сценарий (неизвестные зависимости, циклы)
+    :param stages: Словарь {название этапа: {"action": ..., "params": ..., "after": [...]}}
+    :return: Названия этапов в порядке, в котором их можно выполнить последовательно
+    """
+    for name, stage in stages.items():
+        for dependency in stage.get("after", []):
+            if dependency not in stages:
+                raise ValueError("Этап " + name + " зависит от неизвестного этапа " + dependency)
+
+    order = []
+    done = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [name for name in remaining if all(dep in done for dep in stages[name].get("after", []))]
+        if len(ready) == 0:
+            raise ValueError("В сценарии есть цикл между этапами: " + ", ".join(remaining))
+        for name in ready:
+            order.append(name)
+            done.add(name)
+            remaining.remove(name)
+    return order
+
+
+def run_scenario(stages: dict, workers: int = None) -> dict:
+    """
+    Выполняет этапы сценария. Этап запускается, как только выполнены все этапы из его after.
+    Если этап завершился ошибкой, то зависящие от него этапы пропускаются, остальные продолжают выполняться
+    :param stages: Словарь {название этапа: {"action": действие (по умолчанию = название этапа),
+    "params": параметры, "after": [этапы, после которых он запускается]}}
+    :param workers: Максимальное количество одновременных этапов (None - без ограничения)
+    :return: Словарь {название этапа: статус}
+    """
+    order = get_stages_order(stages)
+    statuses = {}
+    start = time.perf_counter()
+
+    def run_stage(name: str) -> None:
+        stage = stages[name]
+        stage_start = time.perf_counter()
+        print("Этап " + name + " -- Начало")
+        run_action(stage.get("action", name), stage.get("params"), profile_name=str(order.index(name)) + "_" + name)
+        print("Этап " + name + " -- Окончание (" + str(round(time.perf_counter() - stage_start, 1)) + " c)")
+
+    with ThreadPoolExecutor(max_workers=workers or max(1, len(stages))) as executor:
+        running = {}
+
+        def submit_ready() -> None:
+            changed = True
+            while changed:
+                changed = False
+                for name in order:
+                    if name in statuses or name in running.values():
+                        continue
+                    after = stages[name].get("after", [])
+                    if any(statuses.get(dep) in (STATUS_FAILED, STATUS_SKIPPED) for dep in after):
+                        statuses[name] = STATUS_SKIPPED
+                        print("Этап " + name + " пропущен")
+                        changed = True
+                    elif all(statuses.get(dep) == STATUS_DONE for dep in after):
+                        running[executor.submit(run_stage, name)] = name
+
+        submit_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    statuses[name] = STATUS_DONE
+                except Exception as e:
+                    statuses[name] = STATUS_FAILED
+                    print("Этап " + name + " завершился ошибкой: " + repr(e))
+                    if LOGGING_IS_REQUIRED:
+                        logging.error("Этап " + name + " завершился ошибкой", exc_info=e)
+            submit_ready()
+
+    print("Сценарий выполнен за " + str(round(time.perf_counter() - start, 1)) + " c")
+    return statuses
+
+
+def load_scenario(file_name: str) -> dict:
+    """
+    Читает сценарий из json: {"stages": {название этапа: {"action": ..., "params": ..., "after": [...]}}}
+    """
+    with open(file_name, encoding="utf-8") as f:
+        return json.load(f)["stages"]
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Загрузка данных steam в бд")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("list", help="список действий")
+
+    run_parser = subparsers.add_parser("run", help="выполнить одно действие")
+    run_parser.add_argument("action", help="название действия (см. list) или модуль:функция")
+    run_parser.add_argument("--params", default=None,
+                            help="параметры в json: список позиционных или словарь именованных")
+
+    scenario_parser = subparsers.add_parser("scenario", help="выполнить сценарий из json-файла")
+    scenario_parser.add_argument("file_name", help="файл сценария")
+    scenario_parser.add_argument("--workers", type=int, default=None,
+                                 help="максимальное количество одновременных этапов")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for name, target in ACTIONS.items():
+            print(name.ljust(20) + target)
+        return 0
+
+    if LOGGING_IS_REQUIRED:
+        root_logger = logging.getLogger()
+        root_logger.setLevel(logging.INFO)
+        handler = logging.FileHandler(LOG_FILENAME, 'a', 'utf-8')
+        root_logger.addHandler(handler)
+
+    metrics.start_reporting()
+    try:
+        if args.command == "run":
+            params = json.loads(args.params) if args.params else None
+            run_action(args.action, params)
+            return 0
+
+        statuses = run_scenario(load_scenario(args.file_name), args.workers)
+        return 0 if all(status == STATUS_DONE for status in statuses.values()) else 1
+    finally:
+        if METRICS_JSON_FILENAME is not None:
+            metrics.dump_json(METRICS_JSON_FILENAME)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
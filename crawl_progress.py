@@ -0,0 +1,265 @@
+import os
+import socket
+import time
+from typing import Callable, Iterable, TYPE_CHECKING
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from schema import migrate
+from settings import DB_BATCH_SIZE, CRAWL_LEASE_SECONDS, CRAWL_LEASE_POLL_INTERVAL
+
+if TYPE_CHECKING:
+    # Только для аннотаций: numpy не импортируется при запуске
+    from id_set import IdSet
+
+# Этапы загрузки
+STAGE_DETAILS = "details"
+STAGE_TAGS = "tags"
+
+# Статусы приложения на этапе
+STATUS_DONE = "done"
+STATUS_NO_DATA = "no_data"
+
+# Запросы, по которым определялись загруженные приложения до появления таблицы crawl_progress
+_BACKFILL_QUERIES = {
+    STAGE_DETAILS: """
+        SELECT app_id, 'done' FROM apps_categories
+        UNION
+        SELECT app_id, 'done' FROM apps_genres
+        UNION
+        SELECT app_id, 'done' FROM apps_prices
+        UNION
+        SELECT id, 'no_data' FROM apps WHERE no_data_details = True
+    """,
+    STAGE_TAGS: """
+        SELECT app_id, 'done' FROM apps_store_tags
+        UNION
+        SELECT id, 'no_data' FROM apps WHERE no_data_tags = True
+    """,
+}
+
+
+def backfill_crawl_progress(cursor: psycopg2.extensions.cursor, stage: str) -> None:
+    """
+    Если по этапу stage в crawl_progress еще нет записей, то заполняет их по уже загруженным данным.
+    Выполняется один раз, дальше загрузчики ведут crawl_progress сами
+    """
+    cursor.execute(""" SELECT EXISTS (SELECT 1 FROM crawl_progress WHERE stage = %s) """, (stage,))
+    if cursor.fetchone()[0]:
+        return
+
+    cursor.execute("""
+        INSERT INTO crawl_progress (app_id, stage, status)
+        SELECT DISTINCT ON (loaded.app_id) loaded.app_id, %s, loaded.status
+        FROM (""" + _BACKFILL_QUERIES[stage] + """) AS loaded (app_id, status)
+        ORDER BY loaded.app_id, loaded.status
+        ON CONFLICT DO NOTHING
+    """, (stage,))
+
+
+def prepare_crawl_progress(conn: psycopg2.extensions.connection, cursor: psycopg2.extensions.cursor,
+                           stage: str) -> None:
+    """
+    Выполняет миграции схемы (таблицы crawl_progress и crawl_leases) и при необходимости заполняет crawl_progress
+    для этапа stage
+    """
+    migrate(conn)
+    try:
+        backfill_crawl_progress(cursor, stage)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+
+
+def get_pending_ids(cursor: psycopg2.extensions.cursor, stage: str) -> "IdSet":
+    """
+    :return: id приложений, которые еще не загружены на этапе stage
+    (anti-join по первичному ключу crawl_progress, из бд передаются только незагруженные id)
+    """
+    # numpy нужен только загрузчикам
+    from id_set import fetch_id_set
+
+    return fetch_id_set(cursor, """
+        SELECT apps.id FROM apps
+        WHERE NOT EXISTS (
+            SELECT 1 FROM crawl_progress
+            WHERE crawl_progress.stage = %s AND crawl_progress.app_id = apps.id
+        )
+    """, (stage,))
+
+
+def mark_progress(cursor: psycopg2.extensions.cursor, stage: str, statuses: dict,
+                  batch_size: int = DB_BATCH_SIZE) -> None:
+    """
+    Записывает статусы приложений на этапе stage. Вызывается в той же транзакции, что и запись данных
+    :param statuses: Словарь {id приложения: статус}
+    """
+    if len(statuses) == 0:
+        return
+    execute_values(
+        cursor,
+        """
+        INSERT INTO crawl_progress (app_id, stage, status) VALUES %s
+        ON CONFLICT (stage, app_id) DO UPDATE SET status = EXCLUDED.status, fetched_at = now()
+        """,
+        [(app_id, stage, status) for app_id, status in statuses.items()],
+        page_size=batch_size
+    )
+
+
+def get_worker_id() -> str:
+    return socket.gethostname() + ":" + str(os.getpid())
+
+
+def claim_ids(conn: psycopg2.extensions.connection, cursor: psycopg2.extensions.cursor, stage: str, worker_id: str,
+              size: int, after_id: int = 0, lease_seconds: int = CRAWL_LEASE_SECONDS) -> tuple:
+    """
+    Берет в аренду до size незагруженных на этапе stage приложений с id > after_id.
+    Приложения, которые сейчас выбирают другие процессы (SKIP LOCKED) или арендованные ими, пропускаются,
+    приложения с истекшей арендой можно взять снова
+    :return: (id взятых приложений по возрастанию, последний просмотренный id или None, если после after_id
+    незагруженных приложений без действующей аренды нет). Взятых может быть меньше просмотренных,
+    если другой процесс взял их в аренду одновременно с этим
+    """
+    try:
+        cursor.execute("""
+            WITH candidates AS (
+                SELECT apps.id FROM apps
+                WHERE apps.id > %(after_id)s
+                    AND NOT EXISTS (
+                        SELECT 1 FROM crawl_progress
+                        WHERE crawl_progress.stage = %(stage)s AND crawl_progress.app_id = apps.id
+                    )
+                    AND NOT EXISTS (
+                        SELECT 1 FROM crawl_leases
+                        WHERE crawl_leases.stage = %(stage)s AND crawl_leases.app_id = apps.id
+                            AND crawl_leases.leased_until > now()
+                    )
+                ORDER BY apps.id
+                LIMIT %(size)s
+                FOR UPDATE OF apps SKIP LOCKED
+            ), claimed AS (
+                INSERT INTO crawl_leases (app_id, stage, worker_id, leased_until)
+                SELECT candidates.id, %(stage)s, %(worker_id)s, now() + %(lease_seconds)s * interval '1 second'
+                FROM candidates
+                -- Аренда, которую другой процесс записал после начала этого запроса, не перезаписывается
+                ON CONFLICT (stage, app_id) DO UPDATE
+                    SET worker_id = EXCLUDED.worker_id, leased_until = EXCLUDED.leased_until
+                    WHERE crawl_leases.leased_until <= now()
+                RETURNING app_id
+            )
+            SELECT (SELECT max(id) FROM candidates), ARRAY(SELECT app_id FROM claimed ORDER BY app_id)
+        """, {"after_id": after_id, "stage": stage, "worker_id": worker_id, "size": size,
+              "lease_seconds": lease_seconds})
+        last_id, ids = cursor.fetchone()
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    return ids, last_id
+
+
+def release_leases(cursor: psycopg2.extensions.cursor, stage: str, app_ids: Iterable[int]) -> None:
+    """
+    Снимает аренду с приложений. Вызывается в той же транзакции, что и mark_progress
+    """
+    cursor.execute(""" DELETE FROM crawl_leases WHERE stage = %s AND app_id = ANY(%s) """, (stage, list(app_ids)))
+
+
+def count_pending(cursor: psycopg2.extensions.cursor, stage: str) -> int:
+    """
+    :return: Количество незагруженных на этапе stage приложений
+    """
+    cursor.execute("""
+        SELECT count(*) FROM apps
+        WHERE NOT EXISTS (
+            SELECT 1 FROM crawl_progress
+            WHERE crawl_progress.stage = %s AND crawl_progress.app_id = apps.id
+        )
+    """, (stage,))
+    return cursor.fetchone()[0]
+
+
+def get_other_leases_wait(conn: psycopg2.extensions.connection, cursor: psycopg2.extensions.cursor, stage: str,
+                          worker_id: str):
+    """
+    :return: Через сколько секунд истекает ближайшая аренда другого процесса у незагруженного на этапе stage
+    приложения (0, если уже истекла) или None, если таких аренд нет
+    """
+    cursor.execute("""
+        SELECT extract(epoch FROM min(crawl_leases.leased_until) - now()) FROM crawl_leases
+        WHERE crawl_leases.stage = %(stage)s AND crawl_leases.worker_id <> %(worker_id)s
+            AND NOT EXISTS (
+                SELECT 1 FROM crawl_progress
+                WHERE crawl_progress.stage = %(stage)s AND crawl_progress.app_id = crawl_leases.app_id
+            )
+    """, {"stage": stage, "worker_id": worker_id})
+    wait = cursor.fetchone()[0]
+    conn.commit()
+    return max(0.0, float(wait)) if wait is not None else None
+
+
+class LeaseQueue:
+    """
+    Очередь приложений, общая для нескольких процессов (в том числе на разных машинах).
+    Пачки берутся в аренду через таблицу crawl_leases, интерфейс как у WorkQueue.
+    Использует отдельное подключение, т.к. после каждой пачки делает commit
+    """
+
+    def __init__(self, conn: psycopg2.extensions.connection, stage: str, lease_seconds: int = CRAWL_LEASE_SECONDS,
+                 worker_id: str = None, sleep: Callable = None, poll_interval: float = CRAWL_LEASE_POLL_INTERVAL):
+        """
+        :param sleep: Функция ожидания (для gevent - client.sleep), по умолчанию time.sleep
+        :param poll_interval: Как часто проверять аренды других процессов, когда свободных приложений нет
+        """
+        self._conn = conn
+        self._cursor = conn.cursor()
+        self.stage = stage
+        self.lease_seconds = lease_seconds
+        self.worker_id = worker_id or get_worker_id()
+        self._sleep = sleep or time.sleep
+        self.poll_interval = poll_interval
+        self._after_id = 0
+        self.total = count_pending(self._cursor, stage)
+        self.completed = 0
+
+    def next_batch(self, size: int) -> list[int]:
+        """
+        Когда очередь дошла до конца, она проходит с начала, чтобы забрать приложения с истекшей арендой.
+        Пока у других процессов есть аренды незагруженных приложений, очередь ждет их истечения
+        (процесс мог завершиться, не загрузив их), пустой список возвращается, когда таких аренд нет
+        """
+        while True:
+            batch, last_id = claim_ids(self._conn, self._cursor, self.stage, self.worker_id, size, self._after_id,
+                                       self.lease_seconds)
+            if len(batch) > 0:
+                self._after_id = batch[-1]
+                self.completed += len(batch)
+                return batch
+            if last_id is not None:
+                # Все просмотренные приложения одновременно взял другой процесс
+                self._after_id = last_id
+                continue
+            if self._after_id > 0:
+                self._after_id = 0
+                continue
+            wait = get_other_leases_wait(self._conn, self._cursor, self.stage, self.worker_id)
+            if wait is None:
+                return []
+            self._sleep(min(self.poll_interval, max(wait, 1)))
+
+    @property
+    def pending(self) -> int:
+        return max(0, self.total - self.completed)
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def close(self) -> None:
+        """
+        Закрывает курсор и подключение очереди
+        """
+        self._cursor.close()
+        self._conn.close()
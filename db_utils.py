@@ -0,0 +1,143 @@
+import io
+from typing import Iterable
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+import metrics
+from settings import DB_BATCH_SIZE
+
+
+def _to_copy_value(value) -> str:
+    """
+    Приводит значение к текстовому формату COPY
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy_buffer(cursor: psycopg2.extensions.cursor, query: sql.Composable, buffer: io.StringIO,
+                 table_name: str) -> None:
+    buffer.seek(0)
+    with metrics.timer("db_copy_seconds", table=table_name):
+        cursor.copy_expert(query, buffer)
+    metrics.inc("db_round_trips", table=table_name)
+
+
+def copy_rows(cursor: psycopg2.extensions.cursor, table_name: str, columns: list, rows: Iterable,
+              batch_size: int = DB_BATCH_SIZE) -> int:
+    """
+    Записывает строки в таблицу через COPY FROM STDIN (одна операция на batch_size строк)
+    :param cursor: Курсор
+    :param table_name: Название таблицы
+    :param columns: Названия колонок
+    :param rows: Строки (последовательности значений в порядке columns), может быть генератором
+    :param batch_size: Максимальное количество строк в одной операции COPY
+    :return: Количество записанных строк
+    """
+    query = sql.SQL("COPY {0} ({1}) FROM STDIN").format(
+        sql.Identifier(table_name),
+        sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+
+    buffer = io.StringIO()
+    in_buffer = 0
+    count = 0
+    for row in rows:
+        buffer.write("\t".join(_to_copy_value(value) for value in row))
+        buffer.write("\n")
+        in_buffer += 1
+        if in_buffer == batch_size:
+            _copy_buffer(cursor, query, buffer, table_name)
+            count += in_buffer
+            in_buffer = 0
+            buffer = io.StringIO()
+
+    if in_buffer > 0:
+        _copy_buffer(cursor, query, buffer, table_name)
+        count += in_buffer
+
+    metrics.inc("db_rows_written", count, table=table_name)
+    return count
+
+
+def set_flag(cursor: psycopg2.extensions.cursor, table_name: str, col_name: str, ids: Iterable,
+             value: bool = True) -> None:
+    """
+    Устанавливает значение флага col_name для строк с id из ids одним запросом
+    """
+    cursor.execute(
+        sql.SQL("UPDATE {0} SET {1} = %s WHERE id = ANY(%s)").format(sql.Identifier(table_name),
+                                                                     sql.Identifier(col_name)),
+        (value, list(ids))
+    )
+    metrics.inc("db_round_trips", table=table_name)
+    metrics.inc("db_rows_written", cursor.rowcount, table=table_name)
+
+
+def insert_rows(cursor: psycopg2.extensions.cursor, table_name: str, columns: list, rows: Iterable,
+                batch_size: int = DB_BATCH_SIZE) -> None:
+    """
+    Вставляет строки многострочным INSERT ... VALUES, строки с уже существующим ключом пропускаются
+    (ON CONFLICT DO NOTHING). Используется для справочников, в которые могут писать несколько процессов
+    """
+    query = sql.SQL("INSERT INTO {0} ({1}) VALUES %s ON CONFLICT DO NOTHING").format(
+        sql.Identifier(table_name),
+        sql.SQL(", ").join(map(sql.Identifier, columns))
+    )
+    rows = list(rows)
+    with metrics.timer("db_insert_seconds", table=table_name):
+        execute_values(cursor, query.as_string(cursor), rows, page_size=batch_size)
+    metrics.inc("db_round_trips", -(-len(rows) // batch_size), table=table_name)
+    metrics.inc("db_rows_written", len(rows), table=table_name)
+
+
+def upsert_rows(cursor: psycopg2.extensions.cursor, table_name: str, columns: list, rows: Iterable,
+                key_columns: list, batch_size: int = DB_BATCH_SIZE) -> int:
+    """
+    Записывает строки через COPY во временную таблицу и переносит их в table_name одним
+    INSERT ... SELECT ... ON CONFLICT. Строки с уже существующим ключом обновляются (колонки не из key_columns),
+    поэтому повторная запись той же пачки (повтор после ошибки, пачка из spill-файла) не приводит к ошибке
+    :param key_columns: Колонки первичного ключа table_name
+    :return: Количество вставленных или обновленных строк
+    """
+    staging_name = "staging_" + table_name
+    # Временная таблица создается один раз на соединение и очищается при каждом commit
+    cursor.execute(sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {0} ON COMMIT DELETE ROWS AS "
+                           "SELECT {1} FROM {2} WITH NO DATA").format(
+        sql.Identifier(staging_name),
+        sql.SQL(", ").join(map(sql.Identifier, columns)),
+        sql.Identifier(table_name)
+    ))
+    cursor.execute(sql.SQL("TRUNCATE {0}").format(sql.Identifier(staging_name)))
+    if copy_rows(cursor, staging_name, columns, rows, batch_size) == 0:
+        return 0
+
+    update_columns = [column for column in columns if column not in key_columns]
+    if len(update_columns) > 0:
+        # В одной пачке ключ может встретиться несколько раз, DO UPDATE допускает только одну строку на ключ
+        on_conflict = sql.SQL("DO UPDATE SET {0}").format(sql.SQL(", ").join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(column)) for column in update_columns
+        ))
+        distinct = sql.SQL("DISTINCT ON ({0}) ").format(sql.SQL(", ").join(map(sql.Identifier, key_columns)))
+    else:
+        on_conflict = sql.SQL("DO NOTHING")
+        distinct = sql.SQL("")
+
+    query = sql.SQL("INSERT INTO {0} ({1}) SELECT {2}{1} FROM {3} ON CONFLICT ({4}) {5}").format(
+        sql.Identifier(table_name),
+        sql.SQL(", ").join(map(sql.Identifier, columns)),
+        distinct,
+        sql.Identifier(staging_name),
+        sql.SQL(", ").join(map(sql.Identifier, key_columns)),
+        on_conflict
+    )
+    with metrics.timer("db_insert_seconds", table=table_name):
+        cursor.execute(query)
+    metrics.inc("db_round_trips", table=table_name)
+    metrics.inc("db_rows_written", cursor.rowcount, table=table_name)
+    return cursor.rowcount
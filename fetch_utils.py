@@ -0,0 +1,73 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from typing import Callable, Iterable, Iterator
+
+from rate_control import RateLimiter, get_limiter
+from settings import LOGGING_IS_REQUIRED, DETAILS_WORKERS, DETAILS_REQUESTS_PER_SECOND, RESPONSE_CACHE_ENABLED
+from utils import get_details
+
+
+def fetch_concurrently(ids: Iterable[int], fetch_func: Callable[[int], object], workers: int = DETAILS_WORKERS,
+                       limiter: RateLimiter = None) -> Iterator[tuple[int, object]]:
+    """
+    Выполняет fetch_func для каждого id в несколько потоков
+    :param ids: id приложений
+    :param fetch_func: Функция, которая получает данные по одному id
+    :param workers: Максимальное количество одновременных запросов
+    :param limiter: Общий ограничитель частоты запросов
+    :return: Генератор пар (id, результат) в порядке завершения запросов.
+    Если запрос завершился ошибкой, то результат = None
+    """
+
+    def fetch(id: int):
+        if limiter is not None:
+            limiter.acquire()
+        return fetch_func(id)
+
+    ids_iter = iter(ids)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+
+        def submit_next() -> bool:
+            for id in ids_iter:
+                in_flight[executor.submit(fetch, id)] = id
+                return True
+            return False
+
+        for _ in range(workers):
+            if not submit_next():
+                break
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                id = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if LOGGING_IS_REQUIRED:
+                        logging.error("Не удалось получить данные id: " + str(id), exc_info=e)
+                    result = None
+                submit_next()
+                yield id, result
+
+
+def fetch_details(ids: Iterable[int], workers: int = DETAILS_WORKERS, limiter: RateLimiter = None,
+                  requests_per_second: float = DETAILS_REQUESTS_PER_SECOND, use_cache: bool = RESPONSE_CACHE_ENABLED,
+                  cache_only: bool = False) -> Iterator[tuple[int, dict]]:
+    """
+    Получает детали (жанры, категории, цену) приложений параллельно
+    :param ids: id приложений
+    :param workers: Максимальное количество одновременных запросов
+    :param limiter: Общий ограничитель частоты запросов. Если не передан, то берется по requests_per_second.
+    Ответы из кэша не ограничиваются
+    :param requests_per_second: Лимит запросов в секунду ("auto" - подбирается автоматически, None - без ограничения)
+    :param use_cache: Использовать ли кэш ответов
+    :param cache_only: Брать данные только из кэша
+    :return: Генератор пар (id, результат get_details)
+    """
+    if limiter is None:
+        limiter = get_limiter("appdetails", requests_per_second)
+    return fetch_concurrently(ids, partial(get_details, limiter=limiter, use_cache=use_cache, cache_only=cache_only),
+                              workers)
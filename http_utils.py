@@ -0,0 +1,117 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+from settings import LOGGING_IS_REQUIRED, HTTP_TIMEOUT, HTTP_MAX_ATTEMPTS, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX, \
+    HTTP_POOL_SIZE
+
+# Коды ответа, при которых запрос стоит повторить
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Возвращает сессию с пулом keep-alive соединений, общую для всех потоков процесса.
+    Соединения переиспользуются между пачками и потоками, в пуле до HTTP_POOL_SIZE соединений на хост
+    (HTTP_POOL_SIZE должен быть не меньше количества одновременных запросов)
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def get_backoff_delay(attempt: int) -> float:
+    """
+    Экспоненциальная задержка со случайным разбросом (full jitter)
+    :param attempt: Номер неудачной попытки, начиная с 1
+    """
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def get_retry_after(res: requests.Response) -> float:
+    """
+    :return: Задержка в секундах из заголовка Retry-After или None, если заголовка нет
+    """
+    value = res.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(HTTP_BACKOFF_MAX, max(0.0, delay))
+
+
+def http_get(url: str, params: dict = None, timeout=HTTP_TIMEOUT, max_attempts: int = HTTP_MAX_ATTEMPTS,
+             endpoint: str = None, limiter=None, **kwargs) -> requests.Response:
+    """
+    GET-запрос через общий пул соединений.
+    При ошибке соединения и ответах 429/5xx запрос повторяется с экспоненциальной задержкой,
+    при наличии заголовка Retry-After ждет указанное в нем время
+    :param url: Адрес
+    :param params: Параметры запроса
+    :param timeout: Таймаут (секунды или пара (подключение, чтение))
+    :param max_attempts: Количество попыток
+    :param endpoint: Название для метрик (по умолчанию - путь url)
+    :param limiter: Ограничитель частоты запросов (rate_control). Ожидание перед каждой попыткой,
+    после попытки ограничителю сообщается результат
+    :return: Ответ сервера (после последней попытки может быть с кодом 429/5xx)
+    """
+    if endpoint is None:
+        endpoint = urlsplit(url).path
+    attempt = 0
+    while True:
+        attempt += 1
+        if limiter is not None:
+            limiter.acquire()
+        start = time.perf_counter()
+        try:
+            res = get_session().get(url, params=params, timeout=timeout, **kwargs)
+        except requests.RequestException as e:
+            metrics.inc("http_requests", endpoint=endpoint, status="error")
+            if limiter is not None:
+                limiter.report(time.perf_counter() - start, error=True)
+            if attempt >= max_attempts:
+                raise e
+            metrics.inc("http_retries", endpoint=endpoint, reason="error")
+            delay = get_backoff_delay(attempt)
+            if LOGGING_IS_REQUIRED:
+                logging.warning("Попытка обратиться к серверу: " + str(attempt) + ". " + url + ": " + str(e))
+        else:
+            latency = time.perf_counter() - start
+            metrics.observe("http_request_seconds", latency, endpoint=endpoint)
+            metrics.inc("http_requests", endpoint=endpoint, status=res.status_code)
+            retry_after = get_retry_after(res) if res.status_code in RETRY_STATUS_CODES else None
+            if limiter is not None:
+                limiter.report(latency, res.status_code, retry_after=retry_after)
+            if res.status_code not in RETRY_STATUS_CODES or attempt >= max_attempts:
+                return res
+            metrics.inc("http_retries", endpoint=endpoint, reason=res.status_code)
+            delay = retry_after
+            if delay is None:
+                delay = get_backoff_delay(attempt)
+            if LOGGING_IS_REQUIRED:
+                logging.warning("Попытка обратиться к серверу: " + str(attempt) + ". " + url +
+                                ". Status code = " + str(res.status_code))
+        time.sleep(delay)
@@ -0,0 +1,112 @@
+import io
+from typing import Iterable
+
+import numpy as np
+import psycopg2
+
+
+class IdSet:
+    """
+    Множество неотрицательных id (приложений, меток, жанров) в виде массива numpy bool:
+    элемент с индексом id равен True, если id есть в множестве.
+    Занимает 1 байт на каждое число от 0 до максимального id (а не ~60 байт на каждый id, как set),
+    разность, объединение и пересечение выполняются одной векторной операцией
+    """
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self._mask = np.zeros(0, dtype=bool)
+        self.update(ids)
+
+    @classmethod
+    def _from_mask(cls, mask: np.ndarray) -> "IdSet":
+        id_set = cls()
+        id_set._mask = mask
+        return id_set
+
+    def _reserve(self, max_id: int) -> None:
+        if max_id >= len(self._mask):
+            # Запас, чтобы при добавлении id по одному массив не копировался каждый раз
+            mask = np.zeros(max(max_id + 1, len(self._mask) * 3 // 2), dtype=bool)
+            mask[:len(self._mask)] = self._mask
+            self._mask = mask
+
+    def update(self, ids: Iterable[int]) -> None:
+        """
+        Добавляет несколько id (массив numpy добавляется без цикла в python)
+        """
+        if isinstance(ids, IdSet):
+            ids = ids.to_array()
+        ids = np.fromiter(ids, dtype=np.int64) if not isinstance(ids, np.ndarray) else ids.astype(np.int64, copy=False)
+        if len(ids) == 0:
+            return
+        if ids.min() < 0:
+            raise ValueError("id не может быть отрицательным")
+        self._reserve(int(ids.max()))
+        self._mask[ids] = True
+
+    def add(self, id: int) -> None:
+        if id < 0:
+            raise ValueError("id не может быть отрицательным")
+        self._reserve(id)
+        self._mask[id] = True
+
+    def discard(self, id: int) -> None:
+        if 0 <= id < len(self._mask):
+            self._mask[id] = False
+
+    def __contains__(self, id) -> bool:
+        return 0 <= id < len(self._mask) and bool(self._mask[id])
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._mask))
+
+    def __iter__(self):
+        return iter(self.to_array().tolist())
+
+    def to_array(self) -> np.ndarray:
+        """
+        :return: id по возрастанию
+        """
+        return np.flatnonzero(self._mask)
+
+    def _aligned(self, other: "IdSet") -> tuple:
+        size = max(len(self._mask), len(other._mask))
+        return (np.pad(self._mask, (0, size - len(self._mask))),
+                np.pad(other._mask, (0, size - len(other._mask))))
+
+    def difference(self, other: "IdSet") -> "IdSet":
+        mask = self._mask.copy()
+        common = min(len(mask), len(other._mask))
+        mask[:common] &= ~other._mask[:common]
+        return IdSet._from_mask(mask)
+
+    def union(self, other: "IdSet") -> "IdSet":
+        left, right = self._aligned(other)
+        return IdSet._from_mask(left | right)
+
+    def intersection(self, other: "IdSet") -> "IdSet":
+        common = min(len(self._mask), len(other._mask))
+        return IdSet._from_mask(self._mask[:common] & other._mask[:common])
+
+    __sub__ = difference
+    __or__ = union
+    __and__ = intersection
+
+    @property
+    def nbytes(self) -> int:
+        return self._mask.nbytes
+
+
+def fetch_id_set(cursor: psycopg2.extensions.cursor, query: str, params: tuple = None) -> IdSet:
+    """
+    Выполняет запрос, который возвращает одну колонку id (без NULL), и собирает результат в IdSet.
+    Результат передается через COPY TO STDOUT и разбирается numpy, без создания кортежа python на каждую строку
+    """
+    if params is not None:
+        query = cursor.mogrify(query, params).decode()
+    buffer = io.BytesIO()
+    cursor.copy_expert("COPY (" + query + ") TO STDOUT", buffer)
+    data = buffer.getvalue()
+    if not data:
+        return IdSet()
+    return IdSet(np.fromstring(data, dtype=np.int64, sep="\n"))
@@ -0,0 +1,176 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from settings import METRICS_PORT, METRICS_JSON_FILENAME, METRICS_JSON_INTERVAL
+
+# Границы корзин гистограмм задержек в секундах
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_started_at = time.time()
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """
+    Увеличивает счетчик name с метками labels
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    """
+    Устанавливает текущее значение name с метками labels
+    """
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """
+    Добавляет значение (например, задержку в секундах) в гистограмму name с метками labels
+    """
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "sum": 0.0, "count": 0}
+        histogram["buckets"][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+@contextmanager
+def timer(name: str, **labels):
+    """
+    Замеряет время выполнения блока и добавляет его в гистограмму name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _format_labels(labels: tuple, extra: dict = None) -> str:
+    items = list(labels) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(k + '="' + str(v).replace('"', '\\"') + '"' for k, v in items) + "}"
+
+
+def render_prometheus() -> str:
+    """
+    :return: Метрики в текстовом формате Prometheus
+    """
+    lines = []
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            lines.append("steamdb_" + name + "_total" + _format_labels(labels) + " " + str(value))
+        for (name, labels), value in sorted(_gauges.items()):
+            lines.append("steamdb_" + name + _format_labels(labels) + " " + str(value))
+        for (name, labels), histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram["buckets"]):
+                cumulative += count
+                lines.append("steamdb_" + name + "_bucket" + _format_labels(labels, {"le": bound}) + " " +
+                             str(cumulative))
+            lines.append("steamdb_" + name + "_sum" + _format_labels(labels) + " " + str(histogram["sum"]))
+            lines.append("steamdb_" + name + "_count" + _format_labels(labels) + " " + str(histogram["count"]))
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> dict:
+    """
+    :return: Метрики в виде словаря (для json). Для счетчиков также считается среднее значение в секунду
+    """
+    elapsed = max(time.time() - _started_at, 1e-9)
+
+    def label_str(labels):
+        return ",".join(k + "=" + str(v) for k, v in labels)
+
+    with _lock:
+        return {
+            "time": time.time(),
+            "elapsed": elapsed,
+            "counters": [{"name": name, "labels": label_str(labels), "value": value, "per_second": value / elapsed}
+                         for (name, labels), value in sorted(_counters.items())],
+            "gauges": [{"name": name, "labels": label_str(labels), "value": value}
+                       for (name, labels), value in sorted(_gauges.items())],
+            "histograms": [{"name": name, "labels": label_str(labels), "count": h["count"], "sum": h["sum"],
+                            "mean": h["sum"] / h["count"] if h["count"] else None,
+                            "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], h["buckets"]))}
+                           for (name, labels), h in sorted(_histograms.items())],
+        }
+
+
+def dump_json(file_name: str = METRICS_JSON_FILENAME) -> None:
+    tmp_filename = file_name + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, ensure_ascii=False, indent=1)
+    os.replace(tmp_filename, file_name)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = METRICS_PORT) -> ThreadingHTTPServer:
+    """
+    Запускает в отдельном потоке http-сервер, который отдает метрики в формате Prometheus
+    """
+    server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    return server
+
+
+def start_json_dump(file_name: str = METRICS_JSON_FILENAME, interval: float = METRICS_JSON_INTERVAL) -> None:
+    """
+    Запускает поток, который каждые interval секунд записывает метрики в файл file_name
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            dump_json(file_name)
+
+    threading.Thread(target=run, name="MetricsJsonDump", daemon=True).start()
+
+
+def start_reporting() -> None:
+    """
+    Запускает сервер метрик и/или запись в json в соответствии с настройками
+    """
+    if METRICS_PORT is not None:
+        start_metrics_server(METRICS_PORT)
+    if METRICS_JSON_FILENAME is not None:
+        start_json_dump(METRICS_JSON_FILENAME, METRICS_JSON_INTERVAL)
+
+
+def get_total(name: str) -> float:
+    """
+    :return: Сумма счетчика name по всем меткам
+    """
+    with _lock:
+        return sum(value for (counter_name, _), value in _counters.items() if counter_name == name)
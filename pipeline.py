@@ -0,0 +1,171 @@
+import logging
+import queue
+import threading
+from typing import Callable
+
+import psycopg2
+
+import metrics
+from settings import LOGGING_IS_REQUIRED, PIPELINE_QUEUE_SIZE, SPILL_MAX_FAILED_PARTS
+
+_STOP = object()
+
+
+def _is_connection_error(error: Exception) -> bool:
+    """
+    :return: True, если соединение с бд потеряно и следующие записи тоже не пройдут
+    """
+    return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+class BatchWriter:
+    """
+    Отдельный поток, который записывает пачки в бд, пока основной поток получает следующие.
+    Очередь ограничена: если запись не успевает, то put ждет (backpressure).
+    Если передан spill, то запись продолжается после ошибки: части пачки (split) записываются по одной,
+    а части, которые снова не удалось записать, передаются в spill.
+    Если соединение с бд потеряно (или max_failed_parts частей подряд не записались), то запись останавливается:
+    остаток пачки и пачки из очереди передаются в spill без записи, а put перестает принимать пачки
+    """
+
+    def __init__(self, write_func: Callable, max_queued: int = PIPELINE_QUEUE_SIZE, idle: Callable = None,
+                 poll_interval: float = 0.05, name: str = "writer", spill: Callable = None,
+                 split: Callable = None, max_failed_parts: int = SPILL_MAX_FAILED_PARTS):
+        """
+        :param write_func: Функция записи одной пачки
+        :param max_queued: Максимальное количество пачек в очереди
+        :param idle: Функция, которая вызывается, пока put ждет места в очереди
+        (например, client.idle, чтобы не блокировать gevent)
+        :param poll_interval: Как часто put проверяет очередь, если передан idle
+        :param name: Название для метрик
+        :param spill: Функция, которая сохраняет пачку, которую не удалось записать (spill_file.spill_batch)
+        :param split: Функция, которая делит пачку на части (например, по приложениям), чтобы одна ошибочная строка
+        не мешала записи остальных (None - в spill передается вся пачка)
+        :param max_failed_parts: Сколько частей подряд может не записаться, прежде чем запись остановится
+        """
+        self.name = name
+        self._write_func = write_func
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._idle = idle
+        self._poll_interval = poll_interval
+        self._spill = spill
+        self._split = split
+        self._max_failed_parts = max_failed_parts
+        self._failed_parts = 0
+        self._thread = threading.Thread(target=self._run, name="BatchWriter", daemon=True)
+        self.error = None
+
+    def _run(self) -> None:
+        while True:
+            batch = self._queue.get()
+            if batch is _STOP:
+                return
+            if self.error is not None:
+                self._spill_after_error(batch)
+                continue
+            metrics.set_gauge("writer_queue_depth", self._queue.qsize(), writer=self.name)
+            try:
+                with metrics.timer("batch_write_seconds", writer=self.name):
+                    self._write_func(batch)
+                metrics.inc("batches_written", writer=self.name)
+            except Exception as e:
+                if LOGGING_IS_REQUIRED:
+                    logging.error("Ошибка записи пачки", exc_info=True)
+                if self._spill is None:
+                    self.error = e
+                    continue
+                try:
+                    if _is_connection_error(e):
+                        self.error = e
+                        self._spill(batch)
+                    else:
+                        self._write_parts(batch)
+                except Exception as spill_error:
+                    if LOGGING_IS_REQUIRED:
+                        logging.error("Ошибка сохранения пачки в spill-файл", exc_info=True)
+                    self.error = spill_error
+                    self._spill = None
+
+    def _write_parts(self, batch) -> None:
+        """
+        Записывает части пачки, которую не удалось записать целиком, по одной и сохраняет в spill ошибочные части.
+        После потери соединения или max_failed_parts ошибок подряд остальные части сохраняются в spill без записи
+        """
+        if self._split is None:
+            self._spill(batch)
+            return
+        for part in self._split(batch):
+            if self.error is not None:
+                self._spill(part)
+                continue
+            try:
+                self._write_func(part)
+                self._failed_parts = 0
+            except Exception as e:
+                if LOGGING_IS_REQUIRED:
+                    logging.error("Ошибка записи части пачки", exc_info=True)
+                self._spill(part)
+                metrics.inc("batch_parts_spilled", writer=self.name)
+                self._failed_parts += 1
+                if _is_connection_error(e) or self._failed_parts >= self._max_failed_parts:
+                    self.error = e
+
+    def _spill_after_error(self, batch) -> None:
+        """
+        Сохраняет в spill пачку, которая попала в очередь до остановки записи
+        """
+        if self._spill is None:
+            return
+        try:
+            self._spill(batch)
+        except Exception:
+            if LOGGING_IS_REQUIRED:
+                logging.error("Ошибка сохранения пачки в spill-файл", exc_info=True)
+            self._spill = None
+
+    def start(self) -> "BatchWriter":
+        self._thread.start()
+        return self
+
+    def put(self, batch) -> bool:
+        """
+        Ставит пачку в очередь на запись
+        :return: False, если запись уже завершилась ошибкой (пачка не принимается)
+        """
+        if self.error is not None:
+            return False
+        metrics.set_gauge("writer_queue_depth", self._queue.qsize(), writer=self.name)
+        if self._idle is None:
+            self._queue.put(batch)
+            return True
+        while True:
+            try:
+                self._queue.put(batch, timeout=self._poll_interval)
+                return True
+            except queue.Full:
+                if self.error is not None:
+                    return False
+                self._idle()
+
+    @property
+    def queued(self) -> int:
+        """
+        Количество пачек, которые ждут записи
+        """
+        return self._queue.qsize()
+
+    def close(self) -> None:
+        """
+        Дожидается записи всех пачек из очереди
+        """
+        while True:
+            try:
+                self._queue.put(_STOP, timeout=self._poll_interval)
+                break
+            except queue.Full:
+                if self._idle is not None:
+                    self._idle()
+        while self._thread.is_alive():
+            self._thread.join(self._poll_interval)
+            if self._idle is not None:
+                self._idle()
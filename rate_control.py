@@ -0,0 +1,204 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+import metrics
+from settings import LOGGING_IS_REQUIRED, RATE_CONTROL_FILENAME, RATE_CONTROL_LIMITS, RATE_CONTROL_INCREASE, \
+    RATE_CONTROL_DECREASE, RATE_CONTROL_ERROR_DECREASE, RATE_CONTROL_TARGET_LATENCY, RATE_CONTROL_COOLDOWN
+
+# Значение requests_per_second, при котором лимит подбирается автоматически (AdaptiveRateLimiter)
+ADAPTIVE_RATE = "auto"
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты запросов (token bucket), общий для всех потоков
+    """
+
+    def __init__(self, rate: float = None, burst: int = 1):
+        """
+        :param rate: Количество запросов в секунду (None или 0 - без ограничения)
+        :param burst: Сколько запросов можно сделать подряд без ожидания
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._last_wait = None
+        self._lock = threading.Lock()
+
+    def acquire(self, sleep=time.sleep) -> None:
+        """
+        Ждет, пока не появится возможность сделать запрос
+        :param sleep: Функция ожидания (для gevent - gevent.sleep, чтобы не блокировать остальные greenlet)
+        """
+        waited = False
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif not self.rate:
+                    return
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                    self._last = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        if waited:
+                            self._last_wait = now
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            waited = True
+            sleep(wait)
+
+    def report(self, latency: float = None, status_code: int = None, error: bool = False,
+               retry_after: float = None) -> None:
+        """
+        Сообщает результат запроса. Постоянный лимит не меняется,
+        но если сервер указал Retry-After, то новые запросы не выполняются указанное время
+        :param latency: Время выполнения запроса в секундах
+        :param status_code: Код ответа (для http)
+        :param error: Запрос завершился ошибкой (нет соединения, таймаут)
+        :param retry_after: Задержка из заголовка Retry-After
+        """
+        if retry_after:
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    Ограничитель, который подбирает частоту запросов по ответам сервера (AIMD):
+    пока запросы успешны и ограничитель их задерживает, лимит растет на increase запросов в секунду за секунду,
+    после ответа 429 лимит умножается на decrease, после ошибки, 5xx или слишком долгого ответа - на error_decrease
+    (не чаще одного раза за cooldown секунд, чтобы ответы на уже отправленные запросы не снижали лимит повторно)
+    """
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float, endpoint: str = "",
+                 increase: float = RATE_CONTROL_INCREASE, decrease: float = RATE_CONTROL_DECREASE,
+                 error_decrease: float = RATE_CONTROL_ERROR_DECREASE,
+                 target_latency: float = RATE_CONTROL_TARGET_LATENCY, cooldown: float = RATE_CONTROL_COOLDOWN):
+        super().__init__(min(max_rate, max(min_rate, rate)))
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.endpoint = endpoint
+        self.increase = increase
+        self.decrease = decrease
+        self.error_decrease = error_decrease
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self._next_decrease = 0.0
+        metrics.set_gauge("rate_limit", self.rate, endpoint=endpoint)
+
+    def report(self, latency: float = None, status_code: int = None, error: bool = False,
+               retry_after: float = None) -> None:
+        super().report(latency, status_code, error, retry_after)
+
+        if status_code == 429:
+            factor = self.decrease
+        elif error or (status_code is not None and status_code >= 500) or \
+                (latency is not None and latency > self.target_latency):
+            factor = self.error_decrease
+        else:
+            factor = None
+
+        with self._lock:
+            now = time.monotonic()
+            if factor is not None:
+                if now < self._next_decrease:
+                    return
+                self._next_decrease = now + self.cooldown
+                rate = max(self.min_rate, self.rate * factor)
+                if LOGGING_IS_REQUIRED:
+                    logging.warning("Лимит запросов " + self.endpoint + " снижен до " + str(round(rate, 3)) +
+                                    " в секунду (код ответа = " + str(status_code) + ", ошибка = " + str(error) + ")")
+            elif self._last_wait is not None and now - self._last_wait < self.cooldown:
+                # Лимит повышается только если он сейчас ограничивает запросы
+                rate = min(self.max_rate, self.rate + self.increase / self.rate)
+            else:
+                return
+            self.rate = rate
+        metrics.set_gauge("rate_limit", rate, endpoint=self.endpoint)
+
+
+class RateController:
+    """
+    Адаптивные лимиты по endpoint (у каждого свой бюджет запросов).
+    Подобранные лимиты сохраняются в файл и используются как начальные при следующем запуске
+    """
+
+    def __init__(self, file_name: str = RATE_CONTROL_FILENAME, limits: dict = RATE_CONTROL_LIMITS):
+        """
+        :param file_name: Файл с сохраненными лимитами (None - не сохранять)
+        :param limits: Словарь {endpoint: {"rate": начальный лимит, "min_rate": ..., "max_rate": ...}},
+        для endpoint, которого нет в словаре, используются limits["default"]
+        """
+        self.file_name = file_name
+        self.limits = limits
+        self._limiters = {}
+        self._saved_rates = {}
+        self._lock = threading.Lock()
+        if file_name and os.path.exists(file_name):
+            try:
+                with open(file_name, encoding="utf-8") as f:
+                    self._saved_rates = json.load(f)
+            except (OSError, ValueError) as e:
+                if LOGGING_IS_REQUIRED:
+                    logging.warning("Не удалось прочитать сохраненные лимиты запросов", exc_info=e)
+
+    def get_limiter(self, endpoint: str) -> AdaptiveRateLimiter:
+        with self._lock:
+            limiter = self._limiters.get(endpoint)
+            if limiter is None:
+                limits = self.limits.get(endpoint, self.limits["default"])
+                rate = self._saved_rates.get(endpoint, limits["rate"])
+                limiter = AdaptiveRateLimiter(rate, limits["min_rate"], limits["max_rate"], endpoint)
+                self._limiters[endpoint] = limiter
+            return limiter
+
+    def save(self) -> None:
+        """
+        Записывает текущие лимиты в файл (лимиты endpoint, которые не использовались, сохраняются как были)
+        """
+        if not self.file_name:
+            return
+        with self._lock:
+            rates = dict(self._saved_rates)
+            rates.update({endpoint: limiter.rate for endpoint, limiter in self._limiters.items()})
+        os.makedirs(os.path.dirname(self.file_name) or ".", exist_ok=True)
+        tmp_filename = self.file_name + ".tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            json.dump(rates, f, indent=1)
+        os.replace(tmp_filename, self.file_name)
+
+
+_rate_controller = None
+_rate_controller_lock = threading.Lock()
+
+
+def get_rate_controller() -> RateController:
+    """
+    Общий для процесса RateController. Лимиты сохраняются в файл при завершении процесса
+    """
+    global _rate_controller
+    with _rate_controller_lock:
+        if _rate_controller is None:
+            _rate_controller = RateController()
+            atexit.register(_rate_controller.save)
+        return _rate_controller
+
+
+def get_limiter(endpoint: str, requests_per_second=ADAPTIVE_RATE) -> RateLimiter:
+    """
+    :param endpoint: Название endpoint (у каждого свой адаптивный лимит)
+    :param requests_per_second: ADAPTIVE_RATE - лимит подбирается автоматически,
+    число - постоянный лимит, None - без ограничения
+    """
+    if requests_per_second == ADAPTIVE_RATE:
+        return get_rate_controller().get_limiter(endpoint)
+    return RateLimiter(requests_per_second)
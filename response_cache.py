@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from settings import RESPONSE_CACHE_FILENAME, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_SIZE
+
+
+class ResponseCache:
+    """
+    Кэш сырых ответов steam на диске (sqlite, данные сжаты zlib).
+    Ключ записи: (endpoint, key, country). Записи старше ttl считаются устаревшими,
+    при превышении max_size удаляются сначала устаревшие, затем давно не использованные записи
+    """
+
+    def __init__(self, file_name: str = RESPONSE_CACHE_FILENAME, ttl: float = RESPONSE_CACHE_TTL,
+                 max_size: int = RESPONSE_CACHE_MAX_SIZE):
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(file_name, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                endpoint TEXT NOT NULL,
+                key TEXT NOT NULL,
+                country TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (endpoint, key, country)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at_idx ON responses (accessed_at)")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, endpoint: str, key, country: str = "", ignore_ttl: bool = False) -> str:
+        """
+        :param ignore_ttl: Возвращать ли устаревшие записи
+        :return: Сохраненный ответ или None, если его нет (или он устарел)
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, fetched_at FROM responses WHERE endpoint = ? AND key = ? AND country = ?",
+                (endpoint, str(key), country)
+            ).fetchone()
+            if row is None:
+                return None
+            payload, fetched_at = row
+            now = time.time()
+            if not ignore_ttl and self.ttl is not None and now - fetched_at > self.ttl:
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE endpoint = ? AND key = ? AND country = ?",
+                (now, endpoint, str(key), country)
+            )
+        return zlib.decompress(payload).decode("utf-8")
+
+    def put(self, endpoint: str, key, country: str, payload: str) -> None:
+        data = zlib.compress(payload.encode("utf-8"), 6)
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM responses WHERE endpoint = ? AND key = ? AND country = ?",
+                (endpoint, str(key), country)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (endpoint, str(key), country, data, len(data), now, now)
+            )
+            self._size += len(data) - (old[0] if old else 0)
+            if self.max_size is not None and self._size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        """
+        Удаляет устаревшие записи, а если этого мало, то давно не использованные, пока размер не станет 90% от max_size
+        """
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM responses WHERE fetched_at < ?", (time.time() - self.ttl,))
+        target = self.max_size * 0.9
+        size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if size > target:
+            cursor = self._conn.execute("SELECT endpoint, key, country, size FROM responses ORDER BY accessed_at")
+            to_delete = []
+            for endpoint, key, country, row_size in cursor:
+                if size <= target:
+                    break
+                to_delete.append((endpoint, key, country))
+                size -= row_size
+            cursor.close()
+            self._conn.executemany("DELETE FROM responses WHERE endpoint = ? AND key = ? AND country = ?", to_delete)
+        self._size = size
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Возвращает общий кэш ответов (создается при первом обращении)
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+    return _cache
@@ -0,0 +1,177 @@
+"""
+Схема бд с версиями. Каждая миграция выполняется один раз в своей транзакции,
+номер последней выполненной миграции хранится в таблице schema_version.
+Миграции написаны так, чтобы их можно было выполнить и на базе, восстановленной из бэкапа (таблицы уже есть)
+"""
+import psycopg2
+
+# Ключ pg_advisory_xact_lock, чтобы несколько процессов не выполняли миграции одновременно
+_MIGRATION_LOCK_ID = 7311024
+
+
+def _add_primary_key(table_name: str, columns: str) -> str:
+    """
+    :return: SQL, который добавляет первичный ключ в таблицу, если его еще нет
+    """
+    return """
+        DO $$ BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint WHERE conrelid = '{0}'::regclass AND contype = 'p'
+            ) THEN
+                ALTER TABLE {0} ADD PRIMARY KEY ({1});
+            END IF;
+        END $$;
+    """.format(table_name, columns)
+
+
+# (версия, описание, sql)
+MIGRATIONS = [
+    (1, "Основные таблицы", """
+        CREATE TABLE IF NOT EXISTS apps (
+            id integer PRIMARY KEY,
+            name varchar(50),
+            no_data_details boolean NOT NULL DEFAULT False,
+            no_data_tags boolean NOT NULL DEFAULT False
+        );
+        CREATE TABLE IF NOT EXISTS genres (id integer PRIMARY KEY, name varchar(100));
+        CREATE TABLE IF NOT EXISTS categories (id integer PRIMARY KEY, name varchar(100));
+        CREATE TABLE IF NOT EXISTS store_tags (
+            id integer PRIMARY KEY,
+            name varchar(100) NOT NULL DEFAULT '',
+            name_en varchar(100) NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS apps_prices (app_id integer NOT NULL, price integer);
+        CREATE TABLE IF NOT EXISTS apps_genres (app_id integer NOT NULL, genre_id integer NOT NULL);
+        CREATE TABLE IF NOT EXISTS apps_categories (app_id integer NOT NULL, category_id integer NOT NULL);
+        CREATE TABLE IF NOT EXISTS apps_store_tags (app_id integer NOT NULL, tag_id integer NOT NULL, tag_order smallint);
+    """ + _add_primary_key("apps_prices", "app_id")
+        + _add_primary_key("apps_genres", "app_id, genre_id")
+        + _add_primary_key("apps_categories", "app_id, category_id")
+        + _add_primary_key("apps_store_tags", "app_id, tag_id")),
+
+    (2, "Состояние загрузки, аренды, история цен, признак удаления приложения", """
+        ALTER TABLE apps ADD COLUMN IF NOT EXISTS removed boolean NOT NULL DEFAULT False;
+        CREATE TABLE IF NOT EXISTS crawl_progress (
+            app_id integer NOT NULL,
+            stage varchar(16) NOT NULL,
+            status varchar(16) NOT NULL,
+            fetched_at timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (stage, app_id)
+        );
+        CREATE TABLE IF NOT EXISTS crawl_leases (
+            app_id integer NOT NULL,
+            stage varchar(16) NOT NULL,
+            worker_id varchar(128) NOT NULL,
+            leased_until timestamptz NOT NULL,
+            PRIMARY KEY (stage, app_id)
+        );
+        CREATE TABLE IF NOT EXISTS apps_prices_history (
+            app_id integer NOT NULL,
+            country varchar(2) NOT NULL,
+            currency varchar(3),
+            initial integer,
+            final integer,
+            discount_percent smallint,
+            fetched_at timestamptz NOT NULL DEFAULT now(),
+            PRIMARY KEY (app_id, country, fetched_at)
+        );
+    """),
+
+    (3, "Индексы для загрузчиков и аналитики", """
+        CREATE INDEX IF NOT EXISTS apps_store_tags_tag_id_app_id_idx ON apps_store_tags (tag_id, app_id);
+        CREATE INDEX IF NOT EXISTS apps_genres_genre_id_idx ON apps_genres (genre_id);
+        CREATE INDEX IF NOT EXISTS apps_categories_category_id_idx ON apps_categories (category_id);
+        CREATE INDEX IF NOT EXISTS apps_no_data_details_idx ON apps (id) WHERE no_data_details;
+        CREATE INDEX IF NOT EXISTS apps_no_data_tags_idx ON apps (id) WHERE no_data_tags;
+        CREATE INDEX IF NOT EXISTS apps_prices_paid_idx ON apps_prices (app_id) WHERE price > 0;
+    """),
+
+    (4, "Материализованное представление с количеством приложений по меткам", """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS store_tags_counts AS
+            SELECT tag_id, count(*) AS apps_count,
+                   count(*) * 100.0 / (SELECT count(DISTINCT app_id) FROM apps_store_tags) AS share
+            FROM apps_store_tags
+            GROUP BY tag_id;
+        CREATE UNIQUE INDEX IF NOT EXISTS store_tags_counts_tag_id_idx ON store_tags_counts (tag_id);
+    """),
+]
+
+# Материализованные представления (обновляются refresh_materialized_views)
+MATERIALIZED_VIEWS = ["store_tags_counts"]
+
+
+def ensure_schema_version_table(cursor: psycopg2.extensions.cursor) -> None:
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version integer PRIMARY KEY,
+            description text NOT NULL,
+            applied_at timestamptz NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def get_schema_version(cursor: psycopg2.extensions.cursor) -> int:
+    """
+    :return: Номер последней выполненной миграции (0, если миграций не было)
+    """
+    cursor.execute(""" SELECT COALESCE(MAX(version), 0) FROM schema_version """)
+    return cursor.fetchone()[0]
+
+
+def migrate(conn: psycopg2.extensions.connection, target: int = None) -> list[int]:
+    """
+    Выполняет миграции, которые еще не выполнены (до версии target включительно)
+    :param conn: Подключение, в котором нет незавершенной транзакции
+    :param target: Версия, до которой нужно выполнить миграции (None - до последней)
+    :return: Номера выполненных миграций
+    """
+    applied = []
+    cursor = conn.cursor()
+    try:
+        cursor.execute(""" SELECT pg_advisory_xact_lock(%s) """, (_MIGRATION_LOCK_ID,))
+        ensure_schema_version_table(cursor)
+        version = get_schema_version(cursor)
+        conn.commit()
+
+        for migration_version, description, query in MIGRATIONS:
+            if migration_version <= version or (target is not None and migration_version > target):
+                continue
+            cursor.execute(""" SELECT pg_advisory_xact_lock(%s) """, (_MIGRATION_LOCK_ID,))
+            # Другой процесс мог выполнить эту миграцию, пока ждали блокировку
+            if get_schema_version(cursor) >= migration_version:
+                conn.commit()
+                continue
+            cursor.execute(query)
+            cursor.execute(""" INSERT INTO schema_version (version, description) VALUES (%s, %s) """,
+                           (migration_version, description))
+            conn.commit()
+            applied.append(migration_version)
+            print("Миграция " + str(migration_version) + " выполнена: " + description)
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cursor.close()
+
+    return applied
+
+
+def refresh_materialized_views(conn: psycopg2.extensions.connection, concurrently: bool = True) -> None:
+    """
+    Обновляет материализованные представления (MATERIALIZED_VIEWS)
+    :param concurrently: Обновлять без блокировки чтения (нужен уникальный индекс, который есть у всех представлений)
+    """
+    cursor = conn.cursor()
+    try:
+        for view_name in MATERIALIZED_VIEWS:
+            cursor.execute(""" SELECT ispopulated FROM pg_matviews WHERE matviewname = %s """, (view_name,))
+            # Представление, созданное WITH NO DATA, нельзя обновить CONCURRENTLY
+            row = cursor.fetchone()
+            option = "CONCURRENTLY " if concurrently and row is not None and row[0] else ""
+            cursor.execute("REFRESH MATERIALIZED VIEW " + option + view_name)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cursor.close()
@@ -1,7 +1,7 @@
-from script_funcs import save_app_list, load_app_list_sql, load_genres_categories_prices, clear_tables, load_store_tags, \
-    load_tags_name
-from settings import LOG_FILENAME, LOGGING_IS_REQUIRED
+from cli import run_action
+from settings import LOG_FILENAME, LOGGING_IS_REQUIRED, METRICS_JSON_FILENAME
 import logging
+import metrics
 
 if __name__ == '__main__':
     if LOGGING_IS_REQUIRED:
@@ -10,6 +10,8 @@ if __name__ == '__main__':
         handler = logging.FileHandler(LOG_FILENAME, 'a', 'utf-8')
         root_logger.addHandler(handler)
 
+    # Действия выполняются по очереди (названия - см. cli.ACTIONS).
+    # Сценарий с одновременным выполнением независимых этапов: python cli.py scenario scenario.json
     script_scenario = [
         "load_tags_name"
     ]
@@ -18,18 +20,14 @@ if __name__ == '__main__':
         ["name_en", 'english']
     ]
 
-    action_func = {
-        "save_app_list":    save_app_list,
-        "load_apps":        load_app_list_sql,
-        "clear_tables":     clear_tables,
-        "load_details":     load_genres_categories_prices,
-        "load_store_tags":  load_store_tags,
-        "load_tags_name":   load_tags_name
-    }
+    metrics.start_reporting()
 
-    for action, params in zip(script_scenario, script_params):
+    for action_i, (action, params) in enumerate(zip(script_scenario, script_params)):
         print(action)
-        action_func[action](*params)
+        run_action(action, params, profile_name=str(action_i) + "_" + action)
+
+    if METRICS_JSON_FILENAME is not None:
+        metrics.dump_json(METRICS_JSON_FILENAME)
 
 
 
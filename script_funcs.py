@@ -1,69 +1,221 @@
+import datetime
 import json
-import requests
+import os
 import psycopg2
 import logging
+from functools import partial
 from progress.bar import IncrementalBar
-import time
-from selenium_utils import get_tags_info_of_app
 
-from settings import APP_LIST_FILENAME, LOGGING_IS_REQUIRED
-from utils import get_details, copy_required_data, get_db_params, get_loaded_details_ids, get_seen_objects, \
-    get_loaded_tags_id, get_apps_ids, get_tags_data, get_steam_client, get_named_tags, \
-    get_fetch_list_of_unnamed_tags_with_apps_id_ru, insert_tag_name
+import metrics
+from crawl_progress import prepare_crawl_progress, get_pending_ids, mark_progress, release_leases, LeaseQueue, \
+    STAGE_DETAILS, STAGE_TAGS, STATUS_DONE, STATUS_NO_DATA
+from db_utils import copy_rows, insert_rows, set_flag, upsert_rows
+from fetch_utils import fetch_details, fetch_concurrently
+from pipeline import BatchWriter
+from rate_control import get_limiter
+from schema import migrate, refresh_materialized_views
+from settings import APP_LIST_FILENAME, LOGGING_IS_REQUIRED, DETAILS_WORKERS, DETAILS_REQUESTS_PER_SECOND, \
+    DB_BATCH_SIZE, PRODUCT_INFO_CHUNK_SIZE, PRODUCT_INFO_CONCURRENCY, PRODUCT_INFO_REQUESTS_PER_SECOND, \
+    RESPONSE_CACHE_ENABLED, PRICES_CHUNK_SIZE
+from spill_file import spill_batch, replay_spilled_batches
+from utils import copy_required_data, get_db_params, get_seen_objects, get_tags_data, get_steam_client, \
+    get_named_tags, get_fetch_list_of_unnamed_tags_with_apps_id_ru, insert_tag_names, prepare_unnamed_tags_search, \
+    add_seen_apps, iter_app_list, iter_app_list_file, get_prices, get_paid_apps_ids, get_apps_ids
 
 def save_app_list() -> None:
     """
-    Записывает список приложений (список словарей с ключами appid и name) в файл
+    Записывает список приложений (по одному словарю с ключами appid и name на строку) в файл.
+    Ответ api читается и записывается потоком, поэтому весь список не хранится в памяти
+    (повторы отсеиваются по IdSet - 1 байт на каждое число до максимального appid)
     """
+    # numpy (IdSet) нужен только загрузчикам
+    from id_set import IdSet
 
     print("Записывание списка приложений -- Начало")
 
-    res = requests.get("http://api.steampowered.com/ISteamApps/GetAppList/v0002/?format=json")
-    if res.status_code == 200:
-        data = res.json()["applist"]["apps"]
+    os.makedirs(os.path.dirname(APP_LIST_FILENAME) or ".", exist_ok=True)
+    tmp_filename = APP_LIST_FILENAME + ".tmp"
 
-    unique_data = []
-    seen = set()
-    for _dict in data:
-        appid = _dict["appid"]
-        if appid not in seen:
-            unique_data.append({"appid":appid, "name":_dict["name"]})
-            seen.add(appid)
+    seen = IdSet()
+    with open(tmp_filename, 'w', encoding='utf-8') as f:
+        for _dict in iter_app_list():
+            appid = _dict["appid"]
+            if appid not in seen:
+                f.write(json.dumps({"appid": appid, "name": _dict["name"]}, ensure_ascii=False))
+                f.write("\n")
+                seen.add(appid)
 
-    with open(APP_LIST_FILENAME, 'w') as f:
-        json.dump(unique_data, f)
+    os.replace(tmp_filename, APP_LIST_FILENAME)
 
     print("Записывание списка приложений -- Окончание")
 
-def load_app_list_sql() -> None:
+def load_app_list_sql(batch_size=DB_BATCH_SIZE) -> None:
     """
-    Вставляет данные (id и название) о приложениях в sql-таблицу apps
+    Вставляет данные (id и название) о приложениях в sql-таблицу apps.
+    Файл читается построчно и сразу передается в бд
+    :param batch_size: максимальное количество строк в одной операции COPY
     """
 
     print("Загрузка списка приложений -- Начало")
 
     db_params = get_db_params()
 
-    with open(APP_LIST_FILENAME, 'r') as f:
-        data = [(_dict["appid"], _dict["name"][:50]) for _dict in json.load(f)]
+    data = ((_dict["appid"], _dict["name"][:50]) for _dict in iter_app_list_file())
 
     conn = psycopg2.connect(**db_params)
+    migrate(conn)
     cursor = conn.cursor()
-    cursor.executemany(""" INSERT INTO apps (id, name) VALUES (%s, %s) """, data)
+    copy_rows(cursor, "apps", ["id", "name"], data, batch_size)
     conn.commit()
     cursor.close()
     conn.close()
 
     print("Загрузка списка приложений -- Окончание")
 
-def load_genres_categories_prices(bin=100, track_bar=True) -> None:
+def sync_app_list_sql(mark_removed=False, batch_size=DB_BATCH_SIZE) -> None:
+    """
+    Синхронизирует таблицу apps со списком приложений из файла: добавляет новые приложения,
+    обновляет изменившиеся названия и (если mark_removed = True) отмечает приложения, которых больше нет в списке.
+    Список целиком загружается одной операцией COPY во временную таблицу, в apps записываются только изменения
+    :param mark_removed: отмечать ли удаленные приложения (колонка apps.removed)
+    :param batch_size: максимальное количество строк в одной операции COPY
+    """
+
+    print("Синхронизация списка приложений -- Начало")
+
+    db_params = get_db_params()
+
+    data = ((_dict["appid"], _dict["name"][:50]) for _dict in iter_app_list_file())
+
+    conn = psycopg2.connect(**db_params)
+    migrate(conn)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(""" CREATE TEMP TABLE apps_snapshot (id integer, name varchar(50)) ON COMMIT DROP """)
+        copy_rows(cursor, "apps_snapshot", ["id", "name"], data, batch_size)
+        cursor.execute(""" ANALYZE apps_snapshot """)
+
+        cursor.execute("""
+            INSERT INTO apps (id, name)
+            SELECT apps_snapshot.id, apps_snapshot.name FROM apps_snapshot
+            WHERE NOT EXISTS (SELECT 1 FROM apps WHERE apps.id = apps_snapshot.id)
+        """)
+        print("Новых приложений: " + str(cursor.rowcount))
+
+        cursor.execute("""
+            UPDATE apps SET name = apps_snapshot.name
+            FROM apps_snapshot
+            WHERE apps.id = apps_snapshot.id AND apps.name IS DISTINCT FROM apps_snapshot.name
+        """)
+        print("Переименованных приложений: " + str(cursor.rowcount))
+
+        if mark_removed:
+            cursor.execute("""
+                UPDATE apps SET removed = NOT EXISTS (SELECT 1 FROM apps_snapshot WHERE apps_snapshot.id = apps.id)
+                WHERE removed = EXISTS (SELECT 1 FROM apps_snapshot WHERE apps_snapshot.id = apps.id)
+            """)
+            print("Изменился признак удаления: " + str(cursor.rowcount))
+
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        if LOGGING_IS_REQUIRED:
+            logging.error("SQLError", exc_info=True)
+        raise e
+    finally:
+        cursor.close()
+        conn.close()
+
+    print("Синхронизация списка приложений -- Окончание")
+
+def _decode_spilled_batch(batch: dict) -> dict:
+    """
+    Восстанавливает пачку из spill-файла (в json ключи словаря статусов - строки)
+    """
+    batch["statuses"] = {int(id): status for id, status in batch["statuses"].items()}
+    return batch
+
+def _split_batch(batch: dict, rows_keys: dict, ids_keys: tuple) -> list:
+    """
+    Делит пачку загрузчика на части по приложениям, чтобы после ошибки записи пачки записать приложения по одному
+    :param rows_keys: Словарь {ключ строк (app_id, id объекта, ...): ключ новых объектов справочника (id, ...)
+    или None}. В часть попадают только новые объекты, на которые ссылаются строки этого приложения
+    :param ids_keys: Ключи списков id приложений
+    :return: Список пачек (по одной на приложение)
+    """
+    parts = {}
+
+    def get_part(id: int) -> dict:
+        if id not in parts:
+            parts[id] = {key: [] for key in batch}
+            parts[id]["statuses"] = {}
+        return parts[id]
+
+    for id, status in batch["statuses"].items():
+        get_part(id)["statuses"][id] = status
+    for rows_key, new_key in rows_keys.items():
+        new_rows = {row[0]: row for row in batch[new_key]} if new_key is not None else {}
+        for row in batch[rows_key]:
+            part = get_part(row[0])
+            part[rows_key].append(row)
+            if row[1] in new_rows:
+                part[new_key].append(new_rows[row[1]])
+    for ids_key in ids_keys:
+        for id in batch[ids_key]:
+            get_part(id)[ids_key].append(id)
+    return list(parts.values())
+
+def _write_details_batch(conn: psycopg2.extensions.connection, cursor: psycopg2.extensions.cursor, batch: dict,
+                         batch_size: int) -> None:
+    """
+    Записывает пачку жанров, категорий и цен одной транзакцией.
+    Строки записываются через upsert, поэтому пачку можно записать повторно
+    """
+    try:
+        if len(batch["new_genres"]) > 0:
+            insert_rows(cursor, "genres", ["id", "name"], batch["new_genres"], batch_size)
+        if len(batch["new_categories"]) > 0:
+            insert_rows(cursor, "categories", ["id", "name"], batch["new_categories"], batch_size)
+        if len(batch["no_data_ids"]) > 0:
+            set_flag(cursor, "apps", "no_data_details", batch["no_data_ids"])
+        upsert_rows(cursor, "apps_categories", ["app_id", "category_id"], batch["categories"],
+                    ["app_id", "category_id"], batch_size)
+        upsert_rows(cursor, "apps_genres", ["app_id", "genre_id"], batch["genres"], ["app_id", "genre_id"], batch_size)
+        upsert_rows(cursor, "apps_prices", ["app_id", "price"], batch["prices"], ["app_id"], batch_size)
+        mark_progress(cursor, STAGE_DETAILS, batch["statuses"], batch_size)
+        release_leases(cursor, STAGE_DETAILS, batch["statuses"])
+        with metrics.timer("db_commit_seconds", loader="details"):
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        if LOGGING_IS_REQUIRED:
+            logging.error("SQLError", exc_info=True)
+        raise e
+
+def load_genres_categories_prices(bin=100, track_bar=True, workers=DETAILS_WORKERS,
+                                  requests_per_second=DETAILS_REQUESTS_PER_SECOND, batch_size=DB_BATCH_SIZE,
+                                  use_cache=RESPONSE_CACHE_ENABLED, cache_only=False, use_leases=False) -> None:
     """
     Выбирает из таблицы все приложения и получает по ним категории, жанры и цену.
-    Вставка данных в таблицу происходит пачками (размер: bin)
+    Вставка данных в таблицу происходит пачками (размер: bin) в отдельном потоке,
+    пока основной поток получает данные для следующих пачек
     :param bin: размер пачки
     :param track_bar: если параметр = True, то в консоли будет отображаться прогресс полоской загрузки
     False - просто выводом
+    :param workers: количество одновременных запросов к api
+    :param requests_per_second: общий лимит запросов к api в секунду ("auto" - подбирается автоматически по ответам
+    api, None - без ограничения)
+    :param batch_size: максимальное количество строк в одной операции COPY
+    :param use_cache: использовать ли кэш ответов api
+    :param cache_only: брать данные только из кэша ответов, без запросов к api (приложения без ответа в кэше
+    пропускаются). Чтобы заново извлечь данные по всем приложениям, перед этим нужно очистить таблицы данных
+    и crawl_progress
+    :param use_leases: брать пачки в аренду через таблицу crawl_leases, чтобы несколько процессов
+    (в том числе на разных машинах) могли загружать данные одновременно
     """
+    # numpy (очередь приложений) нужен только загрузчикам
+    from work_queue import WorkQueue
+
     print("Загрузка жанров, категорий и цен -- Начало")
 
     db_params = get_db_params()
@@ -76,50 +228,60 @@ def load_genres_categories_prices(bin=100, track_bar=True) -> None:
 
     cursor = conn.cursor()
 
+    prepare_crawl_progress(conn, cursor, STAGE_DETAILS)
+    # Пачки, которые не удалось записать при прошлом запуске (до выбора незагруженных приложений)
+    replay_spilled_batches("details", lambda batch: _write_details_batch(conn, cursor, batch, batch_size),
+                           _decode_spilled_batch)
     seen_genres = get_seen_objects("genres", conn, cursor)
     seen_categories = get_seen_objects("categories", conn, cursor)
-    seen_id = get_loaded_details_ids(conn, cursor)
-    records = get_apps_ids(conn, cursor)
-
-    records_len = len(records)
+    if use_leases:
+        queue = LeaseQueue(psycopg2.connect(**db_params), STAGE_DETAILS)
+    else:
+        queue = WorkQueue(get_pending_ids(cursor, STAGE_DETAILS))
 
     if track_bar:
-        bar = IncrementalBar('Countdown', max=len(records))
-
-    finished = False
+        bar = IncrementalBar('Countdown', max=queue.total)
 
     if not track_bar:
         print("Начало загрузки")
 
-    while not finished:
-        data_prices = []
-        data_genres = []
-        data_categories = []
-
-        data_new_categories = []
-        data_new_genres = []
-
-        no_data_ids = []
-
-        i = 0
-
-        for records_i, id in enumerate(records):
-            if i == bin:
-                if not track_bar:
-                    print("Начало записи до " + str(records_i) + " из " + str(records_len))
-                break
-
-            if id in seen_id:
-                continue
-
-            seen_id.add(id)
-
-            details = get_details(id)
-            time.sleep(0.75)
-
+    limiter = get_limiter("appdetails", requests_per_second)
+    writer = BatchWriter(lambda batch: _write_details_batch(conn, cursor, batch, batch_size), name="details",
+                         spill=partial(spill_batch, "details"),
+                         split=partial(_split_batch, rows_keys={"prices": None, "genres": "new_genres",
+                                                                "categories": "new_categories"},
+                                       ids_keys=("no_data_ids",))).start()
+
+    def iter_queue_ids():
+        while True:
+            batch_ids = queue.next_batch(bin)
+            if len(batch_ids) == 0:
+                return
+            yield from batch_ids
+
+    # Один генератор запросов на всю загрузку: следующие запросы отправляются, как только завершается любой
+    # из текущих (workers запросов одновременно), а не после завершения всей пачки
+    fetched = fetch_details(iter_queue_ids(), workers, limiter, use_cache=use_cache, cache_only=cache_only)
+
+    while True:
+        count = 0
+        batch = {
+            "prices": [],
+            "genres": [],
+            "categories": [],
+            "new_categories": [],
+            "new_genres": [],
+            "no_data_ids": [],
+            "statuses": {},
+        }
+
+        for id, details in fetched:
+            count += 1
             if details is not None:
+                batch["statuses"][id] = STATUS_DONE
                 if "no_data" in details and details["no_data"]:
-                    no_data_ids.append(id)
+                    batch["no_data_ids"].append(id)
+                    batch["statuses"][id] = STATUS_NO_DATA
 
                 if "categories" in details:
                     for category_row in details["categories"]:
@@ -127,9 +289,9 @@ def load_genres_categories_prices(bin=100, track_bar=True) -> None:
                         if category_id not in seen_categories:
                             seen_categories.add(category_id)
                             category_name = category_row["description"]
-                            data_new_categories.append([category_id, category_name])
+                            batch["new_categories"].append([category_id, category_name])
 
-                        data_categories.append([id, category_id])
+                        batch["categories"].append([id, category_id])
 
                 if "genres" in details:
                     for genre_row in details["genres"]:
@@ -137,80 +299,37 @@ def load_genres_categories_prices(bin=100, track_bar=True) -> None:
                         if genre_id not in seen_genres:
                             seen_genres.add(genre_id)
                             genre_name = genre_row["description"]
-                            data_new_genres.append([genre_id, genre_name])
+                            batch["new_genres"].append([genre_id, genre_name])
 
-                        data_genres.append([id, genre_id])
+                        batch["genres"].append([id, genre_id])
 
                 if "price" in details:
-                    data_prices.append([id, details["price"]])
+                    batch["prices"].append([id, details["price"]])
 
-            if track_bar:
-                bar.goto(records_i+1)
-
-            i += 1
-            if records_i == records_len - 1:
-                finished = True
-
-        if len(data_new_genres) > 0:
-            try:
-                cursor.executemany(""" INSERT INTO genres (id, name) VALUES (%s, %s) """, data_new_genres)
-            except Exception as e:
-                if LOGGING_IS_REQUIRED:
-                    logging.error("SQLError", exc_info=True)
-                raise e
-
-        if len(data_new_categories) > 0:
-            try:
-                cursor.executemany(""" INSERT INTO categories (id, name) VALUES (%s, %s) """, data_new_categories)
-            except Exception as e:
-                if LOGGING_IS_REQUIRED:
-                    logging.error("SQLError", exc_info=True)
-                raise e
-
-        if len(no_data_ids) > 0:
-            try:
-                update_query = 'UPDATE apps SET no_data_details = True WHERE id IN {0}'\
-                    .format(no_data_ids).replace("[", "(").replace("]", ")")
-                cursor.execute(update_query)
-            except Exception as e:
-                if LOGGING_IS_REQUIRED:
-                    logging.error("SQLError", exc_info=True)
-                raise e
+            if count == bin:
+                break
 
-        try:
-            try:
-                cursor.executemany(""" INSERT INTO apps_categories (app_id, category_id) VALUES (%s, %s) """,
-                                   data_categories)
-            except Exception as e:
-                if LOGGING_IS_REQUIRED:
-                    logging.error("SQLError", exc_info=True)
-                raise e
-
-            try:
-                cursor.executemany(""" INSERT INTO apps_genres (app_id, genre_id) VALUES (%s, %s) """,
-                                   data_genres)
-            except Exception as e:
-                if LOGGING_IS_REQUIRED:
-                    logging.error("SQLError", exc_info=True)
-                raise e
-
-            try:
-                cursor.executemany(""" INSERT INTO apps_prices (app_id, price) VALUES (%s, %s) """, data_prices)
-            except Exception as e:
-                if LOGGING_IS_REQUIRED:
-                    logging.error("SQLError", exc_info=True)
-                raise e
+        if count == 0:
+            break
 
-            conn.commit()
+        metrics.inc("apps_processed", count, loader="details")
+        metrics.set_gauge("pending_apps", queue.pending, loader="details")
 
-        except Exception as e:
-            conn.rollback()
+        if track_bar:
+            bar.goto(queue.completed)
+        else:
+            print("Получено " + str(queue.completed) + " из " + str(queue.total) +
+                  ", ожидают записи: " + str(writer.queued))
+
+        if not writer.put(batch):
             break
 
-        if not track_bar:
-            print("Запись прошла успешно")
+    # Дожидается запросов, которые уже отправлены
+    fetched.close()
+    writer.close()
 
-        time.sleep(5)
+    if use_leases:
+        queue.close()
 
     if conn:
         cursor.close()
@@ -221,13 +340,54 @@ def load_genres_categories_prices(bin=100, track_bar=True) -> None:
 
     print("Загрузка жанров, категорий и цен -- Окончание")
 
-def load_store_tags(bin=100, max_tag_order=None,track_bar=True) -> None:
+def _write_tags_batch(conn: psycopg2.extensions.connection, cursor: psycopg2.extensions.cursor, batch: dict,
+                      batch_size: int) -> None:
+    """
+    Записывает пачку меток одной транзакцией.
+    Строки записываются через upsert, поэтому пачку можно записать повторно
+    """
+    try:
+        if len(batch["new_tags"]) > 0:
+            insert_rows(cursor, "store_tags", ["id", "name"], batch["new_tags"], batch_size)
+        if len(batch["no_tags_ids"]) > 0:
+            set_flag(cursor, "apps", "no_data_tags", batch["no_tags_ids"])
+        upsert_rows(cursor, "apps_store_tags", ["app_id", "tag_id", "tag_order"], batch["tags"], ["app_id", "tag_id"],
+                    batch_size)
+        mark_progress(cursor, STAGE_TAGS, batch["statuses"], batch_size)
+        release_leases(cursor, STAGE_TAGS, batch["statuses"])
+        with metrics.timer("db_commit_seconds", loader="tags"):
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        if LOGGING_IS_REQUIRED:
+            logging.error("SQLError", exc_info=True)
+        raise e
+
+def load_store_tags(bin=400, max_tag_order=None,track_bar=True, batch_size=DB_BATCH_SIZE,
+                    chunk_size=PRODUCT_INFO_CHUNK_SIZE, concurrency=PRODUCT_INFO_CONCURRENCY,
+                    use_cache=RESPONSE_CACHE_ENABLED, cache_only=False, use_leases=False, client=None,
+                    requests_per_second=PRODUCT_INFO_REQUESTS_PER_SECOND) -> None:
     """
+    Получает метки приложений. Запись пачек в бд происходит в отдельном потоке,
+    пока основной поток получает метки для следующих пачек
     :param bin: размер пачки
     :param track_bar: если параметр = True, то в консоли будет отображаться прогресс полоской загрузки
     False - просто выводом
+    :param batch_size: максимальное количество строк в одной операции COPY
+    :param chunk_size: количество приложений в одном запросе product info
+    :param concurrency: количество одновременных запросов product info (пачка bin делится на части по chunk_size)
+    :param use_cache: использовать ли кэш ответов steam
+    :param cache_only: брать данные только из кэша ответов, без входа в steam (приложения без ответа в кэше
+    пропускаются)
+    :param use_leases: брать пачки в аренду через таблицу crawl_leases, чтобы несколько процессов
+    (в том числе на разных машинах) могли загружать данные одновременно
+    :param client: клиент steam, через который уже выполнен вход (если None, то вход выполняется в функции)
+    :param requests_per_second: лимит запросов product info в секунду ("auto" - подбирается автоматически)
     """
 
+    # numpy (очередь приложений) нужен только загрузчикам
+    from work_queue import WorkQueue
+
     print("Загрузка меток -- Начало")
 
     db_params = get_db_params()
@@ -240,98 +400,172 @@ def load_store_tags(bin=100, max_tag_order=None,track_bar=True) -> None:
 
     cursor = conn.cursor()
 
+    prepare_crawl_progress(conn, cursor, STAGE_TAGS)
+    replay_spilled_batches("tags", lambda batch: _write_tags_batch(conn, cursor, batch, batch_size),
+                           _decode_spilled_batch)
     seen_tags = get_seen_objects("store_tags", conn, cursor)
-    seen_id = get_loaded_tags_id(conn, cursor)
-    records = get_apps_ids(conn, cursor)
 
-    records_len = len(records)
+    if client is None and not cache_only:
+        # Если включена 2-ух факторная аутентификация, то придется ввести код с телефона/почты
+        client = get_steam_client()
 
-    if track_bar:
-        bar = IncrementalBar('Countdown', max=len(records))
+    if use_leases:
+        # Ожидание аренд других процессов не должно блокировать клиент steam (gevent)
+        queue = LeaseQueue(psycopg2.connect(**db_params), STAGE_TAGS,
+                           sleep=client.sleep if client is not None else None)
+    else:
+        queue = WorkQueue(get_pending_ids(cursor, STAGE_TAGS))
 
-    finished = False
+    if track_bar:
+        bar = IncrementalBar('Countdown', max=queue.total)
 
     if not track_bar:
         print("Начало загрузки")
 
-    # Если включена 2-ух факторная аутентификация, то придется ввести код с телефона/почты
-    client = get_steam_client()
-    while not finished:
-        i = 0
-        new_ids = set()
-        for records_i, row in enumerate(records):
-            if i == bin:
-                break
+    limiter = get_limiter("product_info", requests_per_second)
+    # Пока запись не успевает, клиент steam продолжает обрабатывать сообщения (client.idle)
+    writer = BatchWriter(lambda batch: _write_tags_batch(conn, cursor, batch, batch_size),
+                         idle=client.idle if client is not None else None, name="tags",
+                         spill=partial(spill_batch, "tags"),
+                         split=partial(_split_batch, rows_keys={"tags": "new_tags"}, ids_keys=("no_tags_ids",))
+                         ).start()
 
-            id = row
-
-            if id not in seen_id:
-                seen_id.add(id)
-                new_ids.add(id)
-
-                if track_bar:
-                    bar.goto(records_i+1)
-
-                i += 1
-
-            if records_i == records_len - 1:
-                finished = True
+    while True:
+        new_ids = queue.next_batch(bin)
+        if len(new_ids) == 0:
+            break
 
         new_tags = set()
         no_tags_ids = set()
-        if len(new_ids) == 0:
+        failed_ids = set()
+
+        tags_data = get_tags_data(client, new_ids, seen_tags, new_tags, no_tags_ids, max_tag_order=max_tag_order,
+                                  failed_ids=failed_ids, chunk_size=chunk_size, concurrency=concurrency,
+                                  use_cache=use_cache, cache_only=cache_only, limiter=limiter)
+
+        batch = {
+            "tags": tags_data,
+            "new_tags": [(tag, "") for tag in new_tags],
+            "no_tags_ids": no_tags_ids,
+            "statuses": {id: STATUS_NO_DATA if id in no_tags_ids else STATUS_DONE
+                         for id in new_ids if id not in failed_ids},
+        }
+
+        metrics.inc("apps_processed", len(new_ids), loader="tags")
+        metrics.set_gauge("pending_apps", queue.pending, loader="tags")
+
+        if track_bar:
+            bar.goto(queue.completed)
+        else:
+            print("Получено меток до " + str(queue.completed) + " из " + str(queue.total) +
+                  ", ожидают записи: " + str(writer.queued))
+
+        if not writer.put(batch):
             break
 
-        tags_data = get_tags_data(client, new_ids, seen_tags, new_tags, no_tags_ids, max_tag_order=max_tag_order)
-        data_new_tags = [(tag, "") for tag in new_tags]
-
-        print("Начало записи меток до " + str(records_i+1) + " из " + str(records_len))
-        if len(data_new_tags) > 0:
-            try:
-                cursor.executemany(""" INSERT INTO store_tags (id, name) VALUES (%s, %s) """, data_new_tags)
-            except Exception as e:
-                if LOGGING_IS_REQUIRED:
-                    logging.error("SQLError", exc_info=True)
-                raise e
-
-        if len(no_tags_ids) > 0:
-            try:
-                update_query = 'UPDATE apps SET no_data_tags = True WHERE id IN {0}' \
-                    .format(no_tags_ids).replace("{", "(").replace("}", ")")
-                cursor.execute(update_query)
-            except Exception as e:
-                if LOGGING_IS_REQUIRED:
-                    logging.error("SQLError", exc_info=True)
-                raise e
+    writer.close()
 
-        try:
-            try:
-                cursor.executemany(""" INSERT INTO apps_store_tags (app_id, tag_id, tag_order) VALUES (%s, %s, %s) """,
-                                   tags_data)
-            except Exception as e:
-                if LOGGING_IS_REQUIRED:
-                    logging.error("SQLError", exc_info=True)
-                raise e
+    if use_leases:
+        queue.close()
+
+    if conn:
+        cursor.close()
+        conn.close()
 
+    if track_bar:
+        bar.finish()
+
+    print("Загрузка меток -- Окончание")
+
+def _write_prices_batch(conn: psycopg2.extensions.connection, cursor: psycopg2.extensions.cursor, rows: list,
+                        batch_size: int) -> None:
+    """
+    Записывает пачку цен в apps_prices_history одной транзакцией.
+    Время получения цены хранится в строке, поэтому при повторной записи (из spill-файла) оно не меняется
+    """
+    try:
+        upsert_rows(cursor, "apps_prices_history",
+                    ["app_id", "country", "currency", "initial", "final", "discount_percent", "fetched_at"], rows,
+                    ["app_id", "country", "fetched_at"], batch_size)
+        with metrics.timer("db_commit_seconds", loader="prices"):
             conn.commit()
+    except Exception as e:
+        conn.rollback()
+        if LOGGING_IS_REQUIRED:
+            logging.error("SQLError", exc_info=True)
+        raise e
 
-        except Exception as e:
-            conn.rollback()
+def refresh_prices(countries=("ru",), only_paid=True, chunk_size=PRICES_CHUNK_SIZE, workers=DETAILS_WORKERS,
+                   requests_per_second=DETAILS_REQUESTS_PER_SECOND, batch_size=DB_BATCH_SIZE, track_bar=True) -> None:
+    """
+    Получает текущие цены приложений и дописывает их в apps_prices_history (с временем получения).
+    В одном запросе к api запрашиваются цены chunk_size приложений
+    :param countries: коды стран, для которых нужны цены
+    :param only_paid: обновлять цены только приложений с ненулевой ценой в apps_prices (иначе - всех приложений)
+    :param chunk_size: количество приложений в одном запросе
+    :param workers: количество одновременных запросов к api
+    :param requests_per_second: общий лимит запросов к api в секунду ("auto" - подбирается автоматически по ответам
+    api, None - без ограничения)
+    :param batch_size: максимальное количество строк в одной операции COPY
+    :param track_bar: если параметр = True, то в консоли будет отображаться прогресс полоской загрузки
+    """
+    print("Обновление цен -- Начало")
+
+    db_params = get_db_params()
+    conn = psycopg2.connect(**db_params)
+    try:
+        migrate(conn)
+    except Exception as e:
+        conn.close()
+        raise e
+    cursor = conn.cursor()
+
+    ids = get_paid_apps_ids(cursor) if only_paid else get_apps_ids(conn, cursor).to_array().tolist()
+    chunks = [tuple(ids[i:i + chunk_size]) for i in range(0, len(ids), chunk_size)]
+
+    if track_bar:
+        bar = IncrementalBar('Countdown', max=len(chunks) * len(countries))
+
+    limiter = get_limiter("appdetails_prices", requests_per_second)
+    replay_spilled_batches("prices", lambda rows: _write_prices_batch(conn, cursor, rows, batch_size))
+    writer = BatchWriter(lambda rows: _write_prices_batch(conn, cursor, rows, batch_size), name="prices",
+                         spill=partial(spill_batch, "prices"), split=lambda rows: [[row] for row in rows]).start()
+
+    # Запись завершилась ошибкой: цены остальных стран не запрашиваются
+    stopped = False
+    for country in countries:
+        if stopped:
             break
+        rows = []
+        for chunk, prices in fetch_concurrently(chunks, partial(get_prices, country=country, limiter=limiter),
+                                                workers):
+            if prices is not None:
+                fetched_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+                for app_id, price in prices.items():
+                    rows.append((app_id, country, price.get("currency"), price.get("initial"), price.get("final"),
+                                 price.get("discount_percent"), fetched_at))
+
+            if len(rows) >= batch_size:
+                if not writer.put(rows):
+                    stopped = True
+                    break
+                rows = []
 
-        if not track_bar:
-            print("Запись прошла успешно")
+            if track_bar:
+                bar.next()
 
-        time.sleep(10)
+        if len(rows) > 0 and not stopped:
+            stopped = not writer.put(rows)
 
-    if conn:
-        cursor.close()
-        conn.close()
+    writer.close()
+
+    cursor.close()
+    conn.close()
 
     if track_bar:
         bar.finish()
 
-    print("Загрузка меток -- Окончание")
+    print("Обновление цен -- Окончание")
 
 def clear_tables(tables: list) -> None:
     """
@@ -363,43 +597,170 @@ def clear_tables(tables: list) -> None:
     print("Очищение таблиц -- Окочание")
 
 
-def load_tags_name(col_name:str= "name", language:str= 'default') -> None:
+def load_tags_name(col_name:str= "name", language:str= 'default', pages_per_commit:int=20) -> None:
+    """
+    Загружает названия меток со страниц приложений
+    :param col_name: колонка store_tags, в которую записываются названия
+    :param language: язык страниц
+    :param pages_per_commit: названия со скольких страниц записываются одним запросом
+    """
+    # bs4 нужен только для страниц приложений
+    from store_page_utils import get_tags_info_of_app
+
     print("Загрузка меток -- Начало")
     db_params = get_db_params()
     conn = psycopg2.connect(**db_params)
     records = [None]
+    migrate(conn)
     cursor = conn.cursor()
     try:
         seen_tags = get_named_tags(cursor, col_name)
+        prepare_unnamed_tags_search(cursor)
+        conn.commit()
     except Exception as e:
         if conn:
             conn.close()
         if cursor:
             cursor.close()
         raise e
-    seen_apps = set()
+
+    def save_names(tag_names):
+        try:
+            insert_tag_names(cursor, tag_names, col_name)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+
     while len(records) > 0:
-        records = get_fetch_list_of_unnamed_tags_with_apps_id_ru(cursor, col_name, seen_apps)
+        records = get_fetch_list_of_unnamed_tags_with_apps_id_ru(cursor, col_name)
         if len(records) == 0:
             break
 
+        tag_names = []
+        pages = 0
         for row in records:
             app_id = row[1]
-            seen_apps.add(app_id)
             if row[0] in seen_tags:
                 continue
             data = get_tags_info_of_app(app_id, seen_tags, language)
             if data is None:
                 continue
 
-            try:
-                for tag_name, tag_id in data:
-                    print(tag_name, tag_id)
-                    insert_tag_name(cursor, tag_id, tag_name, col_name)
-                conn.commit()
-            except Exception as e:
-                conn.rolback()
-                raise e
+            for tag_name, tag_id in data:
+                print(tag_name, tag_id)
+                tag_names.append((tag_id, tag_name))
+            pages += 1
+
+            if pages == pages_per_commit:
+                save_names(tag_names)
+                tag_names = []
+                pages = 0
+
+        save_names(tag_names)
+
+        try:
+            add_seen_apps(cursor, [row[1] for row in records])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
 
     print("Загрузка меток -- Окончание")
 
+
+
+def update_schema(refresh_views:bool=True) -> None:
+    """
+    Выполняет миграции схемы бд (schema.py) и обновляет материализованные представления
+    :param refresh_views: обновлять ли материализованные представления (количество приложений по меткам)
+    """
+    print("Обновление схемы бд -- Начало")
+
+    db_params = get_db_params()
+    conn = psycopg2.connect(**db_params)
+    try:
+        applied = migrate(conn)
+        print("Выполнено миграций: " + str(len(applied)))
+        if refresh_views:
+            refresh_materialized_views(conn)
+    except Exception as e:
+        if LOGGING_IS_REQUIRED:
+            logging.error("SQLError", exc_info=True)
+        raise e
+    finally:
+        conn.close()
+
+    print("Обновление схемы бд -- Окончание")
+
+
+def export_parquet(full:bool=False, tables:list=None) -> None:
+    """
+    Выгружает данные в файлы parquet в EXPORT_DIRNAME (см. snapshot_export.py)
+    :param full: выгрузить все таблицы заново, иначе в таблицы связей добавляются только новые строки
+    :param tables: список таблиц (None - все)
+    """
+    # pyarrow нужен только для выгрузки
+    from snapshot_export import export_snapshot
+
+    print("Выгрузка в parquet -- Начало")
+
+    db_params = get_db_params()
+    conn = psycopg2.connect(**db_params)
+    try:
+        migrate(conn)
+        export_snapshot(conn, full=full, tables=tables)
+    except Exception as e:
+        if LOGGING_IS_REQUIRED:
+            logging.error("SQLError", exc_info=True)
+        raise e
+    finally:
+        conn.close()
+
+    print("Выгрузка в parquet -- Окончание")
+
+
+def print_tags_analytics(tag_names:list=(), top:int=20, by:str="percent", weighted:bool=False,
+                         col_name:str="name", refresh:bool=False) -> None:
+    """
+    Выводит самые часто встречающиеся метки и метки, которые встречаются вместе с метками tag_names
+    (данные графиков из README). Статистика считается по всем меткам сразу и сохраняется в TAG_STATS_FILENAME
+    :param tag_names: Названия меток (значения col_name)
+    :param top: Количество меток в каждом списке
+    :param by: "percent" - разница в процентах, "lift" - разница в разах (tag_analytics.BY_PERCENT, BY_LIFT)
+    :param weighted: Учитывать порядок меток у приложения (tag_order)
+    :param col_name: Колонка store_tags с названиями меток
+    :param refresh: Посчитать статистику заново, даже если файл еще актуален
+    """
+
+    # numpy и scipy нужны только для статистики
+    from tag_analytics import get_tag_stats, get_tag_names
+
+    print("Статистика меток -- Начало")
+
+    db_params = get_db_params()
+    conn = psycopg2.connect(**db_params)
+    cursor = conn.cursor()
+    try:
+        stats = get_tag_stats(cursor, weighted, refresh)
+        names = get_tag_names(cursor, col_name)
+    finally:
+        cursor.close()
+        conn.close()
+
+    ids_by_name = {name: tag_id for tag_id, name in names.items() if name}
+
+    print("Самые часто встречающиеся метки")
+    for tag_id, count, share in stats.top_tags(top):
+        print("{0}\t{1}\t{2:.2f}%".format(names.get(tag_id) or tag_id, count, share))
+
+    for tag_name in tag_names:
+        tag_id = ids_by_name.get(tag_name)
+        if tag_id is None:
+            print("Метка " + tag_name + " не найдена")
+            continue
+        print("Метки, которые встречаются вместе с меткой " + tag_name)
+        for related_id, value, count in stats.related_tags(tag_id, top, by):
+            print("{0}\t{1:.2f}\t{2}".format(names.get(related_id) or related_id, value, count))
+
+    print("Статистика меток -- Окончание")
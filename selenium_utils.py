@@ -1,6 +1,31 @@
+import atexit
+
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 
+from settings import STORE_URL
+
+_driver = None
+
+def get_driver() -> webdriver.Chrome:
+    """
+    Возвращает общий (один на процесс) headless браузер. Браузер закрывается при завершении процесса
+    """
+    global _driver
+    if _driver is None:
+        options = webdriver.ChromeOptions()
+        options.add_argument("--headless=new")
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        _driver = webdriver.Chrome(options=options)
+        atexit.register(quit_driver)
+    return _driver
+
+def quit_driver() -> None:
+    global _driver
+    if _driver is not None:
+        _driver.quit()
+        _driver = None
+
 def get_tags_info_of_app(app_id: int, seen_tags:set, language:str='default') -> list[list[str, int]]:
     """
     Заходит на страницу приложения и считывает имена меток
@@ -9,9 +34,9 @@ def get_tags_info_of_app(app_id: int, seen_tags:set, language:str='default') ->
     :param language: Язык страницы (и соответственно меток)
     :return: Список[Список[Имя метки, id Метки]]
     """
-    driver = webdriver.Chrome()
+    driver = get_driver()
     s_app_id = str(app_id)
-    url = "https://store.steampowered.com/app/" + s_app_id + ("" if language == "default" else "?l=" + language)
+    url = STORE_URL + "app/" + s_app_id + ("" if language == "default" else "?l=" + language)
     driver.get(url)
     data = []
     try:
@@ -22,10 +47,10 @@ def get_tags_info_of_app(app_id: int, seen_tags:set, language:str='default') ->
             tag_id = int(elem.get_attribute("data-tagid"))
             if tag_id in seen_tags:
                 continue
-            tag_name = elem.find_element(By.CLASS_NAME, "app_tag").text.replace("'", "")
+            tag_name = elem.find_element(By.CLASS_NAME, "app_tag").text
             data.append([tag_name, tag_id])
             seen_tags.add(tag_id)
     except Exception as e:
         return None
 
-    return data
\ No newline at end of file
+    return data
@@ -1,5 +1,116 @@
+import os
+
 STEAM_GUARD_FILENAME = "guard.json"
-DB_CONFIGURATION_FILENAME = "dbconnect.json"
-APP_LIST_FILENAME = "Results/AppList.json"
+DB_CONFIGURATION_FILENAME = os.environ.get("STEAMDB_DB_CONFIG", "dbconnect.json")
+# Список приложений в формате json lines (один json-объект на строку)
+APP_LIST_FILENAME = os.environ.get("STEAMDB_APP_LIST_FILENAME", "Results/AppList.jsonl")
 LOGGING_IS_REQUIRED = True
-LOG_FILENAME = "py_log.log"
\ No newline at end of file
+LOG_FILENAME = "py_log.log"
+
+# Адрес store api (можно переопределить, например, для локального сервера-заглушки)
+STORE_API_URL = os.environ.get("STEAMDB_STORE_API_URL", "https://store.steampowered.com/api/")
+# Количество одновременных запросов appdetails
+DETAILS_WORKERS = 4
+# Общий лимит запросов appdetails в секунду (None - без ограничения, "auto" - подбирается автоматически,
+# см. RATE_CONTROL_*)
+DETAILS_REQUESTS_PER_SECOND = "auto"
+
+# Адрес web api steam
+STEAM_WEB_API_URL = os.environ.get("STEAMDB_WEB_API_URL", "https://api.steampowered.com/")
+# Таймауты http-запросов в секундах: (подключение, чтение)
+HTTP_TIMEOUT = (10, 30)
+# Количество попыток http-запроса
+HTTP_MAX_ATTEMPTS = 5
+# Базовая и максимальная задержка между попытками в секундах
+HTTP_BACKOFF_BASE = 1
+HTTP_BACKOFF_MAX = 120
+# Размер пула соединений на один хост (не меньше DETAILS_WORKERS, пул общий для всех потоков)
+HTTP_POOL_SIZE = 16
+# Максимальное количество строк в одной операции COPY / INSERT
+DB_BATCH_SIZE = 10000
+# Максимальное количество пачек, которые ждут записи в бд
+PIPELINE_QUEUE_SIZE = 4
+# Папка для пачек, которые не удалось записать в бд (файл на каждый загрузчик,
+# пачки записываются повторно при следующем запуске загрузчика)
+SPILL_DIRNAME = os.environ.get("STEAMDB_SPILL_DIRNAME", "Results/spill")
+# Сколько частей пачки подряд может не записаться, прежде чем запись остановится (бд, скорее всего, недоступна)
+SPILL_MAX_FAILED_PARTS = 20
+# Количество приложений в одном запросе product info (steam CM)
+PRODUCT_INFO_CHUNK_SIZE = 100
+# Количество одновременных запросов product info
+PRODUCT_INFO_CONCURRENCY = 4
+# Таймаут одного запроса product info в секундах
+PRODUCT_INFO_TIMEOUT = 30
+# Количество попыток запроса product info для одной части
+PRODUCT_INFO_MAX_ATTEMPTS = 3
+# Лимит запросов product info в секунду (None - без ограничения, "auto" - подбирается автоматически)
+PRODUCT_INFO_REQUESTS_PER_SECOND = "auto"
+# Папка для sentry-файла и ключа входа steam (вход без кода steam guard при следующих запусках)
+STEAM_CREDENTIALS_DIRNAME = os.environ.get("STEAMDB_STEAM_CREDENTIALS_DIRNAME", "Results/steam")
+# Количество попыток переподключения к steam после разрыва соединения
+STEAM_RELOGIN_MAX_ATTEMPTS = 5
+# Максимальная задержка перед переподключением в секундах
+STEAM_RECONNECT_MAX_DELAY = 30
+
+# Адрес магазина steam (страницы приложений)
+STORE_URL = os.environ.get("STEAMDB_STORE_URL", "https://store.steampowered.com/")
+# Использовать ли браузер (selenium), если метки не удалось получить из html страницы
+TAGS_BROWSER_FALLBACK = True
+
+# Локальный кэш ответов steam (appdetails, product info)
+RESPONSE_CACHE_ENABLED = True
+RESPONSE_CACHE_FILENAME = os.environ.get("STEAMDB_RESPONSE_CACHE_FILENAME", "Results/response_cache.sqlite")
+# Время жизни записи в кэше в секундах
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60
+# Максимальный размер кэша (сжатых данных) в байтах
+RESPONSE_CACHE_MAX_SIZE = 2 * 1024 ** 3
+# Время аренды (lease) пачки приложений одним процессом загрузки в секундах
+CRAWL_LEASE_SECONDS = 30 * 60
+# Как часто проверять аренды других процессов, когда свободных приложений не осталось (секунды)
+CRAWL_LEASE_POLL_INTERVAL = 60
+
+# Количество приложений в одном запросе цен (appdetails с filters=price_overview)
+PRICES_CHUNK_SIZE = 100
+
+# Порт http-сервера с метриками в формате Prometheus (None - сервер не запускается)
+METRICS_PORT = None
+# Файл, в который периодически записываются метрики в формате json (None - не записываются)
+METRICS_JSON_FILENAME = None
+# Период записи метрик в json в секундах
+METRICS_JSON_INTERVAL = 30
+# Папка для результатов cProfile по действиям (None - профилирование выключено)
+PROFILE_DIRNAME = None
+
+# Файл со статистикой меток (совместная встречаемость, разница в процентах и в разах)
+TAG_STATS_FILENAME = os.environ.get("STEAMDB_TAG_STATS_FILENAME", "Results/tag_stats.npz")
+# Время, через которое статистика меток считается заново, в секундах
+TAG_STATS_MAX_AGE = 24 * 60 * 60
+
+# Автоматический подбор лимитов запросов (AIMD, rate_control.AdaptiveRateLimiter)
+# Файл, в котором сохраняются подобранные лимиты между запусками
+RATE_CONTROL_FILENAME = os.environ.get("STEAMDB_RATE_CONTROL_FILENAME", "Results/rate_control.json")
+# Начальный, минимальный и максимальный лимиты (запросов в секунду) по endpoint
+RATE_CONTROL_LIMITS = {
+    "appdetails":        {"rate": 1.3, "min_rate": 0.1, "max_rate": 20},
+    "appdetails_prices": {"rate": 1.3, "min_rate": 0.1, "max_rate": 20},
+    "product_info":      {"rate": 5, "min_rate": 0.2, "max_rate": 50},
+    "default":           {"rate": 1, "min_rate": 0.1, "max_rate": 20},
+}
+# На сколько запросов в секунду лимит растет за секунду успешных запросов
+RATE_CONTROL_INCREASE = 0.02
+# Во сколько раз уменьшается лимит после ответа 429
+RATE_CONTROL_DECREASE = 0.5
+# Во сколько раз уменьшается лимит после ошибки, ответа 5xx или ответа дольше RATE_CONTROL_TARGET_LATENCY секунд
+RATE_CONTROL_ERROR_DECREASE = 0.8
+RATE_CONTROL_TARGET_LATENCY = 5
+# Минимальное время в секундах между двумя снижениями лимита
+RATE_CONTROL_COOLDOWN = 5
+
+# Папка для выгрузки данных в parquet (snapshot_export.py)
+EXPORT_DIRNAME = os.environ.get("STEAMDB_EXPORT_DIRNAME", "Results/snapshot")
+# Количество строк, которые читаются из бд и записываются в parquet за один раз
+EXPORT_BATCH_SIZE = 100000
+# Сжатие файлов parquet
+EXPORT_COMPRESSION = "zstd"
+# Отставание водяного знака от времени выгрузки в секундах (должно быть больше самой долгой транзакции загрузчиков)
+EXPORT_WATERMARK_LAG = 10 * 60
@@ -0,0 +1,202 @@
+"""
+Выгрузка данных из бд в файлы parquet (по колонкам, со словарным кодированием и сжатием).
+Каждая таблица - папка с частями part-NNNNN.parquet, список частей и водяные знаки хранятся в manifest.json.
+Справочники и apps выгружаются целиком при каждой выгрузке, таблицы связей и история цен - только новые строки
+(новой частью), поэтому повторная выгрузка читает из бд только то, что загружено после предыдущей.
+Если приложение загружено заново, то новая часть содержит все его строки, а в старых частях остаются прежние:
+read_snapshot_table берет строки приложения только из последней части, в которой оно есть
+"""
+import datetime
+import json
+import os
+
+import psycopg2
+import psycopg2.extensions
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from crawl_progress import STAGE_DETAILS, STAGE_TAGS
+from settings import EXPORT_DIRNAME, EXPORT_BATCH_SIZE, EXPORT_COMPRESSION, EXPORT_WATERMARK_LAG
+
+MANIFEST_FILENAME = "manifest.json"
+
+# Таблица: (колонки и их типы, этап crawl_progress для новых строк или колонка времени, или None - выгружать целиком)
+EXPORT_TABLES = {
+    "apps": ([("id", pa.int32()), ("name", pa.string()), ("no_data_details", pa.bool_()),
+              ("no_data_tags", pa.bool_()), ("removed", pa.bool_())], None),
+    "genres": ([("id", pa.int32()), ("name", pa.string())], None),
+    "categories": ([("id", pa.int32()), ("name", pa.string())], None),
+    "store_tags": ([("id", pa.int32()), ("name", pa.string()), ("name_en", pa.string())], None),
+    "apps_genres": ([("app_id", pa.int32()), ("genre_id", pa.int32())], ("stage", STAGE_DETAILS)),
+    "apps_categories": ([("app_id", pa.int32()), ("category_id", pa.int32())], ("stage", STAGE_DETAILS)),
+    "apps_prices": ([("app_id", pa.int32()), ("price", pa.int32())], ("stage", STAGE_DETAILS)),
+    "apps_store_tags": ([("app_id", pa.int32()), ("tag_id", pa.int32()), ("tag_order", pa.int16())],
+                        ("stage", STAGE_TAGS)),
+    "apps_prices_history": ([("app_id", pa.int32()), ("country", pa.string()), ("currency", pa.string()),
+                             ("initial", pa.int32()), ("final", pa.int32()), ("discount_percent", pa.int16()),
+                             ("fetched_at", pa.timestamp("us", tz="UTC"))], ("column", "fetched_at")),
+}
+
+
+def load_manifest(export_dir: str = EXPORT_DIRNAME) -> dict:
+    file_name = os.path.join(export_dir, MANIFEST_FILENAME)
+    if not os.path.exists(file_name):
+        return {"tables": {}}
+    with open(file_name, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, export_dir: str = EXPORT_DIRNAME) -> None:
+    file_name = os.path.join(export_dir, MANIFEST_FILENAME)
+    tmp_filename = file_name + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_filename, file_name)
+
+
+def _get_query(table_name: str, columns: list, increment, low: str, high: str):
+    """
+    :return: (запрос, параметры) для строк таблицы, добавленных после водяного знака low и не позже high
+    """
+    select = ", ".join("t." + column for column, _ in columns)
+    if increment is None:
+        return "SELECT " + select + " FROM " + table_name + " AS t", None
+
+    kind, value = increment
+    if kind == "column":
+        if low is None:
+            return "SELECT " + select + " FROM " + table_name + " AS t WHERE t." + value + " <= %s", (high,)
+        return ("SELECT " + select + " FROM " + table_name + " AS t WHERE t." + value + " > %s AND t." + value +
+                " <= %s", (low, high))
+    if low is None:
+        # Первая выгрузка: все строки, кроме приложений, загруженных после high (они попадут в следующую часть)
+        return ("SELECT " + select + " FROM " + table_name + " AS t WHERE NOT EXISTS (SELECT 1 FROM crawl_progress AS p"
+                " WHERE p.stage = %s AND p.app_id = t.app_id AND p.fetched_at > %s)", (value, high))
+    return ("SELECT " + select + " FROM " + table_name + " AS t JOIN crawl_progress AS p"
+            " ON p.stage = %s AND p.app_id = t.app_id WHERE p.fetched_at > %s AND p.fetched_at <= %s",
+            (value, low, high))
+
+
+def export_table(conn: psycopg2.extensions.connection, table_name: str, file_name: str, query: str,
+                 params: tuple, columns: list, batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """
+    Записывает результат запроса в файл parquet. Строки читаются серверным (именованным) курсором
+    пачками по batch_size, в памяти одновременно находится только одна пачка
+    :return: Количество записанных строк
+    """
+    schema = pa.schema(columns)
+    tmp_filename = file_name + ".tmp"
+    cursor = conn.cursor(name="export_" + table_name)
+    cursor.itersize = batch_size
+    count = 0
+    try:
+        cursor.execute(query, params)
+        with pq.ParquetWriter(tmp_filename, schema, compression=EXPORT_COMPRESSION, use_dictionary=True) as writer:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                arrays = [pa.array([row[i] for row in rows], type=column_type)
+                          for i, (_, column_type) in enumerate(columns)]
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
+                count += len(rows)
+    except Exception as e:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise e
+    finally:
+        cursor.close()
+
+    os.replace(tmp_filename, file_name)
+    return count
+
+
+def export_snapshot(conn: psycopg2.extensions.connection, export_dir: str = EXPORT_DIRNAME, full: bool = False,
+                    batch_size: int = EXPORT_BATCH_SIZE, tables: list = None) -> dict:
+    """
+    Выгружает таблицы EXPORT_TABLES в export_dir. Все таблицы читаются в одной транзакции (один снимок бд)
+    :param full: Выгрузить таблицы заново (нужно после clear_tables или ручных изменений в бд),
+    иначе для таблиц связей и истории цен добавляется новая часть
+    :param tables: Список таблиц (None - все)
+    :return: manifest
+    """
+    # Записи таблиц, которые не выгружаются сейчас, остаются в manifest как были
+    manifest = load_manifest(export_dir)
+    conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    try:
+        cursor = conn.cursor()
+        # Строки, записанные незадолго до выгрузки, могут принадлежать еще не завершенным транзакциям
+        # с более ранним временем, поэтому водяной знак отстает от текущего времени
+        cursor.execute(""" SELECT now() - %s * interval '1 second' """, (EXPORT_WATERMARK_LAG,))
+        high = cursor.fetchone()[0].isoformat()
+        cursor.close()
+
+        for table_name, (columns, increment) in EXPORT_TABLES.items():
+            if tables is not None and table_name not in tables:
+                continue
+            table_dir = os.path.join(export_dir, table_name)
+            os.makedirs(table_dir, exist_ok=True)
+            table_info = manifest["tables"].get(table_name, {"partitions": [], "watermark": None})
+
+            rewrite = full or increment is None or table_info["watermark"] is None
+            if rewrite:
+                table_info = {"partitions": [], "watermark": None}
+
+            query, params = _get_query(table_name, columns, increment, table_info["watermark"], high)
+            partition_name = "part-" + str(len(table_info["partitions"])).zfill(5) + ".parquet"
+            file_name = os.path.join(table_dir, partition_name)
+            count = export_table(conn, table_name, file_name, query, params, columns, batch_size)
+            if count > 0 or len(table_info["partitions"]) == 0:
+                table_info["partitions"].append({
+                    "file": table_name + "/" + partition_name,
+                    "rows": count,
+                    "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                })
+            else:
+                os.remove(file_name)
+            if rewrite:
+                # Части от предыдущих выгрузок (часть 00000 уже заменена новой)
+                for old_filename in os.listdir(table_dir):
+                    if old_filename.startswith("part-") and old_filename != partition_name:
+                        os.remove(os.path.join(table_dir, old_filename))
+            if increment is not None:
+                table_info["watermark"] = high
+            manifest["tables"][table_name] = table_info
+            print("Таблица " + table_name + ": " + str(count) + " строк")
+        conn.commit()
+    finally:
+        conn.rollback()
+        conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_DEFAULT, readonly=False)
+
+    save_manifest(manifest, export_dir)
+    return manifest
+
+
+def read_snapshot_table(table_name: str, export_dir: str = EXPORT_DIRNAME, columns: list = None) -> pa.Table:
+    """
+    Читает все части таблицы из выгрузки (файлы отображаются в память, а не читаются целиком).
+    У таблиц связей строки приложения берутся из последней части, в которой оно есть (без повторов после
+    повторной загрузки приложения)
+    :param columns: Нужные колонки (None - все)
+    """
+    manifest = load_manifest(export_dir)
+    partitions = manifest["tables"][table_name]["partitions"]
+    increment = EXPORT_TABLES[table_name][1]
+    if increment is None or increment[0] != "stage":
+        return pa.concat_tables([
+            pq.read_table(os.path.join(export_dir, partition["file"]), columns=columns, memory_map=True)
+            for partition in partitions
+        ])
+
+    # Части читаются от новой к старой, из старых частей берутся только приложения, которых нет в более новых
+    read_columns = columns if columns is None or "app_id" in columns else columns + ["app_id"]
+    parts = []
+    seen_ids = pa.array([], type=pa.int32())
+    for partition in reversed(partitions):
+        part = pq.read_table(os.path.join(export_dir, partition["file"]), columns=read_columns, memory_map=True)
+        if len(seen_ids) > 0:
+            part = part.filter(pc.invert(pc.is_in(part["app_id"], value_set=seen_ids)))
+        seen_ids = pa.concat_arrays([seen_ids, pc.unique(part["app_id"]).cast(pa.int32())])
+        parts.append(part if read_columns is columns else part.drop(["app_id"]))
+    return pa.concat_tables(parts[::-1])
@@ -0,0 +1,118 @@
+"""
+Пачки, которые не удалось записать в бд, сохраняются в локальный файл (json lines, свой для каждого загрузчика)
+и записываются повторно при следующем запуске загрузчика, поэтому полученные из steam данные не приходится
+запрашивать заново. Запись пачек идемпотентна (upsert), поэтому пачку можно записать повторно,
+даже если она уже частично записана.
+Дописывание и повтор выполняются под блокировкой файла, поэтому файл могут использовать несколько потоков
+и процессов (например, загрузчики с арендой пачек на одной машине)
+"""
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+import metrics
+from settings import LOGGING_IS_REQUIRED, SPILL_DIRNAME
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: блокировка только между потоками одного процесса
+    fcntl = None
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def get_spill_filename(kind: str, dir_name: str = SPILL_DIRNAME) -> str:
+    """
+    :param kind: Загрузчик, которому принадлежат пачки (details, tags, prices)
+    """
+    return os.path.join(dir_name, kind + ".jsonl")
+
+
+@contextmanager
+def _locked(file_name: str):
+    """
+    Блокирует spill-файл для потоков этого процесса и для других процессов
+    """
+    os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+    with _locks_lock:
+        thread_lock = _locks.setdefault(file_name, threading.Lock())
+    with thread_lock:
+        with open(file_name + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def spill_batch(kind: str, batch, dir_name: str = SPILL_DIRNAME) -> None:
+    """
+    Дописывает пачку в spill-файл загрузчика kind
+    :param batch: Пачка (множества записываются как списки)
+    """
+    file_name = get_spill_filename(kind, dir_name)
+    line = json.dumps(batch, ensure_ascii=False, default=list) + "\n"
+    with _locked(file_name):
+        with open(file_name, "a", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+    metrics.inc("batches_spilled", loader=kind)
+    if LOGGING_IS_REQUIRED:
+        logging.warning("Пачка " + kind + " сохранена в " + file_name)
+
+
+def replay_spilled_batches(kind: str, write_func: Callable, decode: Callable = None,
+                           dir_name: str = SPILL_DIRNAME) -> int:
+    """
+    Записывает в бд пачки из spill-файла загрузчика kind. Пачки, которые снова не удалось записать, остаются в файле.
+    Файл заблокирован до конца повтора: другой процесс не может одновременно повторять те же пачки
+    :param write_func: Функция записи одной пачки
+    :param decode: Функция, которая восстанавливает пачку после json (например, ключи словарей - числа)
+    :return: Количество записанных пачек
+    """
+    file_name = get_spill_filename(kind, dir_name)
+    if not os.path.exists(file_name):
+        return 0
+
+    written = 0
+    with _locked(file_name):
+        if not os.path.exists(file_name):
+            return 0
+        with open(file_name, encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+
+        kept = []
+        for line in lines:
+            batch = json.loads(line)
+            if decode is not None:
+                batch = decode(batch)
+            try:
+                write_func(batch)
+                written += 1
+            except Exception:
+                if LOGGING_IS_REQUIRED:
+                    logging.error("Не удалось повторно записать пачку " + kind, exc_info=True)
+                kept.append(line)
+
+        if len(kept) > 0:
+            tmp_filename = file_name + ".tmp"
+            with open(tmp_filename, "w", encoding="utf-8") as f:
+                f.writelines(kept)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, file_name)
+        else:
+            os.remove(file_name)
+
+    metrics.inc("batches_replayed", written, loader=kind)
+    print("Повторно записано пачек " + kind + ": " + str(written) + ", осталось в " + file_name + ": " +
+          str(len(kept)))
+    return written
@@ -0,0 +1,130 @@
+"""
+Сессия steam (CM), которая переживает разрывы соединения.
+Sentry-файл и ключ входа (login key) сохраняются в STEAM_CREDENTIALS_DIRNAME, поэтому при следующих запусках
+вход выполняется по ключу, без пароля и кода steam guard. Если соединение разорвалось во время загрузки,
+то перед следующим запросом клиент переподключается и снова входит в аккаунт по ключу
+"""
+import logging
+import os
+
+import gevent.lock
+from steam.client import SteamClient
+from steam.enums import EResult
+
+import metrics
+from settings import LOGGING_IS_REQUIRED, STEAM_CREDENTIALS_DIRNAME, STEAM_RELOGIN_MAX_ATTEMPTS, \
+    STEAM_RECONNECT_MAX_DELAY
+
+
+class SteamSession:
+    """
+    Обертка SteamClient с сохранением ключа входа и переподключением.
+    Методы get_product_info, sleep, idle и свойство logged_on такие же, как у SteamClient
+    """
+
+    def __init__(self, username: str, password: str, credentials_dir: str = STEAM_CREDENTIALS_DIRNAME):
+        """
+        :param credentials_dir: Папка для sentry-файла и ключа входа
+        """
+        self.username = username
+        self.password = password
+        self.credentials_dir = credentials_dir
+        os.makedirs(credentials_dir, exist_ok=True)
+
+        self.client = SteamClient()
+        # Sentry-файл (подтверждение steam guard для этого компьютера) сохраняет сам SteamClient
+        self.client.set_credential_location(credentials_dir)
+        self.client.on(SteamClient.EVENT_NEW_LOGIN_KEY, self._save_login_key)
+        self.client.on(SteamClient.EVENT_DISCONNECTED, self._handle_disconnect)
+        self._lock = gevent.lock.Semaphore()
+        self._closed = False
+
+    @property
+    def logged_on(self) -> bool:
+        return self.client.logged_on
+
+    def _get_login_key_path(self) -> str:
+        return os.path.join(self.credentials_dir, self.username + "_login_key.txt")
+
+    def _load_login_key(self):
+        """
+        :return: Сохраненный ключ входа или None
+        """
+        file_name = self._get_login_key_path()
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, encoding="utf-8") as f:
+            return f.read().strip() or None
+
+    def _save_login_key(self) -> None:
+        file_name = self._get_login_key_path()
+        tmp_filename = file_name + ".tmp"
+        # Ключ заменяет пароль, поэтому файл доступен только владельцу
+        with os.fdopen(os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w",
+                       encoding="utf-8") as f:
+            f.write(self.client.login_key)
+        os.replace(tmp_filename, file_name)
+
+    def _remove_login_key(self) -> None:
+        file_name = self._get_login_key_path()
+        if os.path.exists(file_name):
+            os.remove(file_name)
+
+    def _handle_disconnect(self, *args) -> None:
+        if self._closed:
+            return
+        metrics.inc("cm_disconnects")
+        if LOGGING_IS_REQUIRED:
+            logging.warning("Соединение со steam разорвано")
+
+    def login(self, interactive: bool = True) -> EResult:
+        """
+        Входит в аккаунт по сохраненному ключу, если ключа нет или он не подошел - по паролю
+        :param interactive: Можно ли запросить код steam guard (с телефона/почты) в консоли
+        :return: Результат входа
+        """
+        login_key = self._load_login_key()
+        if login_key is not None:
+            result = self.client.login(self.username, login_key=login_key)
+            if result == EResult.OK:
+                return result
+            if result == EResult.InvalidPassword:
+                # Ключ больше не действует, новый придет после входа по паролю
+                self._remove_login_key()
+
+        if interactive:
+            return self.client.cli_login(self.username, self.password)
+        return self.client.login(self.username, self.password)
+
+    def relogin(self, max_attempts: int = STEAM_RELOGIN_MAX_ATTEMPTS) -> None:
+        """
+        Переподключается и входит в аккаунт, если соединение разорвано.
+        Если вызывается одновременно из нескольких greenlet, то переподключение выполняется один раз
+        """
+        with self._lock:
+            attempt = 0
+            while not self.client.logged_on:
+                attempt += 1
+                if attempt > max_attempts:
+                    raise ConnectionAbortedError("Не удалось переподключиться к steam")
+                metrics.inc("cm_reconnects")
+                # Задержка перед подключением растет с каждой попыткой
+                if not self.client.connected and not self.client.reconnect(maxdelay=STEAM_RECONNECT_MAX_DELAY):
+                    continue
+                result = self.login(interactive=False)
+                if LOGGING_IS_REQUIRED:
+                    logging.warning("Переподключение к steam, попытка " + str(attempt) + ". Результат = " +
+                                    str(result))
+
+    def get_product_info(self, apps=(), packages=(), timeout=15, **kwargs):
+        return self.client.get_product_info(apps=apps, packages=packages, timeout=timeout, **kwargs)
+
+    def sleep(self, seconds: float) -> None:
+        self.client.sleep(seconds)
+
+    def idle(self) -> None:
+        self.client.idle()
+
+    def logout(self) -> None:
+        self._closed = True
+        self.client.logout()
@@ -0,0 +1,90 @@
+import json
+import logging
+
+from bs4 import BeautifulSoup
+
+from http_utils import http_get
+from settings import LOGGING_IS_REQUIRED, STORE_URL, TAGS_BROWSER_FALLBACK
+
+# Cookies, чтобы страницы с проверкой возраста открывались сразу
+AGE_CHECK_COOKIES = {
+    "birthtime": "283993201",
+    "lastagecheckage": "1-0-1979",
+    "wants_mature_content": "1",
+    "mature_content": "1",
+}
+
+_TAG_MODAL_MARKER = "InitAppTagModal"
+
+
+def get_app_page_url(app_id: int, language: str = 'default') -> str:
+    return STORE_URL + "app/" + str(app_id) + ("" if language == "default" else "?l=" + language)
+
+
+def parse_tags_info(html: str) -> list[tuple[str, int]]:
+    """
+    Достает метки приложения из html страницы магазина (список меток передается в InitAppTagModal)
+    :return: Список [(Имя метки, id метки)] или None, если меток на странице нет
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    decoder = json.JSONDecoder()
+    for script in soup.find_all("script"):
+        text = script.string
+        if not text or _TAG_MODAL_MARKER not in text:
+            continue
+        start = text.find("[", text.find(_TAG_MODAL_MARKER))
+        if start == -1:
+            continue
+        try:
+            tags, _ = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            continue
+        return [(tag["name"], int(tag["tagid"])) for tag in tags if "tagid" in tag and "name" in tag]
+    return None
+
+
+def get_tags_info_from_page(app_id: int, language: str = 'default') -> list[tuple[str, int]]:
+    """
+    Загружает страницу приложения обычным http-запросом и считывает метки
+    :return: Список [(Имя метки, id метки)] или None, если меток получить не удалось
+    """
+    res = http_get(get_app_page_url(app_id, language), cookies=AGE_CHECK_COOKIES, endpoint="store_page")
+    if res.status_code != 200:
+        if LOGGING_IS_REQUIRED:
+            logging.warning("Не удалось загрузить страницу id: " + str(app_id) +
+                            ". Status code = " + str(res.status_code))
+        return None
+    return parse_tags_info(res.text)
+
+
+def get_tags_info_of_app(app_id: int, seen_tags: set, language: str = 'default',
+                         browser_fallback: bool = TAGS_BROWSER_FALLBACK) -> list[list[str, int]]:
+    """
+    Считывает имена меток приложения. Сначала из html страницы,
+    если не получилось, то (при browser_fallback = True) через браузер
+    :param app_id: id приложения
+    :param seen_tags: id меток, которые нужно пропустить
+    :param language: Язык страницы (и соответственно меток)
+    :param browser_fallback: Использовать ли браузер, если метки не найдены в html
+    :return: Список[Список[Имя метки, id Метки]]
+    """
+    try:
+        tags_info = get_tags_info_from_page(app_id, language)
+    except Exception as e:
+        if LOGGING_IS_REQUIRED:
+            logging.warning("Не удалось получить метки из страницы id: " + str(app_id), exc_info=e)
+        tags_info = None
+
+    if tags_info is None:
+        if not browser_fallback:
+            return None
+        from selenium_utils import get_tags_info_of_app as get_tags_info_of_app_browser
+        return get_tags_info_of_app_browser(app_id, seen_tags, language)
+
+    data = []
+    for tag_name, tag_id in tags_info:
+        if tag_id in seen_tags:
+            continue
+        data.append([tag_name, tag_id])
+        seen_tags.add(tag_id)
+    return data
@@ -0,0 +1,176 @@
+import io
+import os
+import time
+
+import numpy as np
+import psycopg2
+from scipy import sparse
+
+from settings import TAG_STATS_FILENAME, TAG_STATS_MAX_AGE
+
+# Способы сравнения меток (как на графиках в README)
+BY_PERCENT = "percent"  # разница в процентах
+BY_LIFT = "lift"        # разница в разах
+
+
+def get_tag_weights(tag_orders: np.ndarray) -> np.ndarray:
+    """
+    Вес метки у приложения по ее порядку (первые метки важнее): 1 / (tag_order + 1)
+    """
+    return 1.0 / (tag_orders.astype(np.float64) + 1.0)
+
+
+def load_app_tag_matrix(cursor: psycopg2.extensions.cursor, weighted: bool = False) -> tuple:
+    """
+    Загружает apps_store_tags одним COPY в разреженную матрицу приложения x метки
+    :param cursor: Курсор
+    :param weighted: True - значения матрицы равны весам по tag_order, False - единицы
+    :return: (матрица csr, массив id приложений (строки), массив id меток (столбцы))
+    """
+    buffer = io.BytesIO()
+    cursor.copy_expert("COPY (SELECT app_id, tag_id, COALESCE(tag_order, 0) FROM apps_store_tags) TO STDOUT",
+                       buffer)
+    buffer.seek(0)
+    rows = np.loadtxt(buffer, dtype=np.int64, delimiter="\t", ndmin=2)
+    if rows.shape[0] == 0:
+        rows = np.empty((0, 3), dtype=np.int64)
+
+    app_ids, app_index = np.unique(rows[:, 0], return_inverse=True)
+    tag_ids, tag_index = np.unique(rows[:, 1], return_inverse=True)
+    if weighted:
+        values = get_tag_weights(rows[:, 2])
+    else:
+        values = np.ones(rows.shape[0], dtype=np.float64)
+
+    matrix = sparse.csr_matrix((values, (app_index, tag_index)), shape=(len(app_ids), len(tag_ids)))
+    return matrix, app_ids, tag_ids
+
+
+class TagStats:
+    """
+    Частота меток, совместная встречаемость и разница (в процентах и в разах) для всех пар меток.
+    Строка i матриц - метка tag_ids[i], столбец j - метка, которая встречается вместе с ней.
+    Если weighted, то counts и cooccurrence - суммы весов, а количества приложений хранятся в pair_counts
+    """
+
+    def __init__(self, tag_ids: np.ndarray, apps_count: int, counts: np.ndarray, cooccurrence: np.ndarray,
+                 pair_counts: np.ndarray, weighted: bool = False, created_at: float = None):
+        """
+        :param pair_counts: Количество приложений с обеими метками (без весов), на диагонали - с одной меткой
+        """
+        self.tag_ids = tag_ids
+        self.apps_count = apps_count
+        self.counts = counts
+        self.cooccurrence = cooccurrence
+        self.pair_counts = pair_counts
+        self.weighted = weighted
+        self.created_at = time.time() if created_at is None else created_at
+        self._index = {int(tag_id): i for i, tag_id in enumerate(tag_ids)}
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Доля приложений с меткой j среди всех приложений и среди приложений с меткой i (в процентах)
+            self.share = counts / apps_count * 100 if apps_count else np.zeros_like(counts)
+            self.conditional_share = np.nan_to_num(cooccurrence / counts[:, None] * 100)
+            self.percent_difference = self.conditional_share - self.share[None, :]
+            self.lift = np.nan_to_num(self.conditional_share / self.share[None, :], posinf=0)
+
+    def get_matrix(self, by: str) -> np.ndarray:
+        if by == BY_PERCENT:
+            return self.percent_difference
+        if by == BY_LIFT:
+            return self.lift
+        raise ValueError("Неизвестный способ сравнения меток: " + str(by))
+
+    def top_tags(self, top: int = 20) -> list:
+        """
+        :return: Самые часто встречающиеся метки, список (id метки, количество приложений, доля в процентах)
+        """
+        order = np.argsort(-self.counts, kind="stable")[:top]
+        return [(int(self.tag_ids[i]), int(self.pair_counts[i, i]), float(self.share[i])) for i in order]
+
+    def related_tags(self, tag_id: int, top: int = 20, by: str = BY_PERCENT, min_apps: float = 1) -> list:
+        """
+        Метки, которые встречаются вместе с меткой tag_id (одна строка уже посчитанной матрицы)
+        :param tag_id: id метки
+        :param top: Количество меток в результате
+        :param by: BY_PERCENT - сортировка по разнице в процентах, BY_LIFT - по разнице в разах
+        :param min_apps: Минимальное количество приложений с обеими метками
+        :return: Список (id метки, разница, количество приложений с обеими метками)
+        """
+        i = self._index.get(int(tag_id))
+        if i is None:
+            return []
+
+        values = self.get_matrix(by)[i]
+        candidates = np.flatnonzero(self.pair_counts[i] >= min_apps)
+        candidates = candidates[candidates != i]
+        order = candidates[np.argsort(-values[candidates], kind="stable")][:top]
+        return [(int(self.tag_ids[j]), float(values[j]), int(self.pair_counts[i, j])) for j in order]
+
+
+def compute_tag_stats(matrix: sparse.csr_matrix, tag_ids: np.ndarray, weighted: bool = False) -> TagStats:
+    """
+    Считает совместную встречаемость всех пар меток одним умножением матриц (X.T @ X)
+    :param matrix: Матрица приложения x метки из load_app_tag_matrix
+    :param tag_ids: id меток (столбцы матрицы)
+    :param weighted: Матрица содержит веса по tag_order (тогда вместо количеств приложений используются суммы весов)
+    """
+    matrix = matrix.tocsr()
+    apps_count = matrix.shape[0]
+    counts = np.asarray(matrix.sum(axis=0)).ravel()
+    cooccurrence = (matrix.T @ matrix).toarray()
+    if weighted:
+        # Количества приложений считаются по той же матрице без весов
+        binary = matrix.copy()
+        binary.data = np.ones_like(binary.data)
+        pair_counts = (binary.T @ binary).toarray()
+    else:
+        pair_counts = cooccurrence
+    return TagStats(tag_ids, apps_count, counts, cooccurrence, pair_counts.astype(np.int64), weighted)
+
+
+def save_tag_stats(stats: TagStats, file_name: str = TAG_STATS_FILENAME) -> None:
+    os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+    tmp_filename = file_name + ".tmp.npz"
+    np.savez_compressed(tmp_filename, tag_ids=stats.tag_ids, apps_count=stats.apps_count, counts=stats.counts,
+                        cooccurrence=stats.cooccurrence, pair_counts=stats.pair_counts, weighted=stats.weighted,
+                        created_at=stats.created_at)
+    os.replace(tmp_filename, file_name)
+
+
+def load_tag_stats(file_name: str = TAG_STATS_FILENAME) -> TagStats:
+    """
+    :return: Статистика из файла или None, если файл записан предыдущей версией (без pair_counts)
+    """
+    with np.load(file_name) as data:
+        if "pair_counts" not in data:
+            return None
+        return TagStats(data["tag_ids"], int(data["apps_count"]), data["counts"], data["cooccurrence"],
+                        data["pair_counts"], bool(data["weighted"]), float(data["created_at"]))
+
+
+def get_tag_stats(cursor: psycopg2.extensions.cursor, weighted: bool = False, refresh: bool = False,
+                  file_name: str = TAG_STATS_FILENAME, max_age: float = TAG_STATS_MAX_AGE) -> TagStats:
+    """
+    Возвращает статистику меток из файла file_name, если он не старше max_age секунд и посчитан с тем же weighted,
+    иначе считает ее заново по apps_store_tags и сохраняет в файл
+    :param refresh: True - всегда считать заново
+    """
+    if not refresh and file_name and os.path.exists(file_name):
+        stats = load_tag_stats(file_name)
+        if stats is not None and stats.weighted == weighted and time.time() - stats.created_at <= max_age:
+            return stats
+
+    matrix, _, tag_ids = load_app_tag_matrix(cursor, weighted)
+    stats = compute_tag_stats(matrix, tag_ids, weighted)
+    if file_name:
+        save_tag_stats(stats, file_name)
+    return stats
+
+
+def get_tag_names(cursor: psycopg2.extensions.cursor, col_name: str = "name") -> dict:
+    """
+    :return: Словарь {id метки: название из col_name}
+    """
+    cursor.execute(""" SELECT id, {0} FROM store_tags """.format(col_name))
+    return {tag_id: name for tag_id, name in cursor.fetchall()}
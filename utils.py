@@ -1,10 +1,21 @@
-from settings import LOGGING_IS_REQUIRED, DB_CONFIGURATION_FILENAME, STEAM_GUARD_FILENAME
+from settings import LOGGING_IS_REQUIRED, DB_CONFIGURATION_FILENAME, STEAM_GUARD_FILENAME, STORE_API_URL, \
+    HTTP_MAX_ATTEMPTS, STEAM_WEB_API_URL, APP_LIST_FILENAME, PRODUCT_INFO_CHUNK_SIZE, PRODUCT_INFO_CONCURRENCY, \
+    PRODUCT_INFO_TIMEOUT, PRODUCT_INFO_MAX_ATTEMPTS, DB_BATCH_SIZE, RESPONSE_CACHE_ENABLED
+import codecs
 import json
-import requests
 import logging
+import time
 import psycopg2
-from steam.client import SteamClient
-from steam.enums import EResult
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from typing import Iterable, Iterator, TYPE_CHECKING
+
+import metrics
+from response_cache import get_response_cache
+
+if TYPE_CHECKING:
+    # Только для аннотаций: numpy не импортируется при запуске
+    from id_set import IdSet
 
 def get_json_params(file_name:str) -> dict:
     with open(file_name, 'r') as f:
@@ -17,14 +28,19 @@ def get_guard_params() -> dict:
     return get_json_params(STEAM_GUARD_FILENAME)
 
 def get_steam_client():
+    """
+    :return: SteamSession (вход по сохраненному ключу или по паролю, переподключение при разрыве соединения)
+    """
+    # steam и gevent импортируются только при необходимости, чтобы действия без steam запускались быстрее
+    from steam.enums import EResult
+    from steam_session import SteamSession
+
     steam_params = get_guard_params()
-    login = steam_params["LOGIN"]
-    password = steam_params["PASSWORD"]
-    client = SteamClient()
-    res = client.cli_login(login, password)
+    session = SteamSession(steam_params["LOGIN"], steam_params["PASSWORD"])
+    res = session.login()
 
     if res == EResult.OK:
-        return client
+        return session
     else:
         raise ConnectionAbortedError("Не удалось войти в аккаунт steam. Результат = ", str(res))
 
@@ -44,47 +60,120 @@ def copy_required_data(data: dict, keys: list, raise_exception=False) -> dict:
             req_data[key] = data[key]
     return req_data
 
-def get_details(id: int, max_attempts:int=5) -> dict:
-    s_id = str(id)
-    attempt_i = 0
-    get_res = False
-    while not get_res:
+def iter_json_array_items(chunks: Iterable[str], array_key: str) -> Iterator:
+    """
+    Построчно (по одному элементу) разбирает массив array_key из json, который приходит частями.
+    В памяти хранится только текущая часть json, а не весь документ
+    :param chunks: Части json-документа (строки)
+    :param array_key: Ключ массива, элементы которого нужно получить
+    :return: Генератор элементов массива
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    marker = '"' + array_key + '"'
+
+    buffer = ""
+    while True:
+        pos = buffer.find(marker)
+        if pos != -1:
+            bracket = buffer.find("[", pos + len(marker))
+            if bracket != -1:
+                buffer = buffer[bracket + 1:]
+                break
+        else:
+            buffer = buffer[-len(marker):]
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        buffer += chunk
+
+    idx = 0
+    ended = False
+    while True:
+        while idx < len(buffer) and buffer[idx] in " \t\r\n,":
+            idx += 1
+        if idx < len(buffer) and buffer[idx] == "]":
+            return
         try:
-            res = requests.get("https://store.steampowered.com/api/appdetails?appids=" + s_id + "&cc=ru")
-            get_res = True
-        except Exception as e:
-            attempt_i += 1
-            print("Попытка обратиться к серверу : " + str(attempt_i))
-            if attempt_i == max_attempts:
+            item, end = decoder.raw_decode(buffer, idx)
+        except json.JSONDecodeError as e:
+            if ended:
                 raise e
-    game_data = None
-    if res.status_code == 200:
-        try:
-            res_json = res.json()
-        except Exception as e:
-            if LOGGING_IS_REQUIRED:
-                logging.error("Не удалось расшифровать json id: " + s_id, exc_info=e)
-            raise e
-        res_json = res_json[s_id]
-        if "success" in res_json and res_json["success"] and "data" in res_json:
-            res_json = res_json["data"]
-            game_data = copy_required_data(res_json, ["genres", "categories"])
-            game_data["price"] = None
-            if res_json["is_free"]:
-                game_data["price"] = 0
-            else:
-                if "price_overview" in res_json:
-                    game_data["price"] = res_json["price_overview"]["final"] // 100
-                else:
-                    if LOGGING_IS_REQUIRED:
-                        logging.warning("No price for id: " + s_id)
+            end = None
+        if end is not None:
+            # Число или true/false/null может продолжаться в следующей части ("[1,2" + "3]"),
+            # поэтому элемент готов, только когда после него уже есть "," или "]" (или json закончился)
+            next_idx = end
+            while next_idx < len(buffer) and buffer[next_idx] in " \t\r\n":
+                next_idx += 1
+            if ended or (next_idx < len(buffer) and buffer[next_idx] in ",]"):
+                idx = end
+                yield item
+                continue
+        chunk = next(chunks, None)
+        if chunk is None:
+            ended = True
         else:
-            game_data = {"no_data": True}
-            if LOGGING_IS_REQUIRED:
-                logging.warning("No details for id: " + s_id)
+            buffer = buffer[idx:] + chunk
+            idx = 0
+
+
+def iter_app_list(chunk_size: int = 1 << 16) -> Iterator[dict]:
+    """
+    Получает список приложений (словари с ключами appid и name) потоком, без загрузки всего ответа в память
+    """
+    from http_utils import http_get
+
+    res = http_get(STEAM_WEB_API_URL + "ISteamApps/GetAppList/v0002/", params={"format": "json"}, stream=True,
+                   endpoint="GetAppList")
+    with res:
+        if res.status_code != 200:
+            raise ConnectionError("Не удалось получить список приложений. Status code = " + str(res.status_code))
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        chunks = (decoder.decode(chunk) for chunk in res.iter_content(chunk_size))
+        yield from iter_json_array_items(chunks, "apps")
+
+
+def iter_app_list_file(file_name: str = APP_LIST_FILENAME) -> Iterator[dict]:
+    """
+    Построчно читает файл со списком приложений (json lines)
+    """
+    with open(file_name, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def parse_details(id: int, payload: str) -> dict:
+    """
+    Извлекает жанры, категории и цену из ответа appdetails
+    :param id: id приложения
+    :param payload: Текст ответа appdetails
+    :return: Словарь с ключами genres, categories, price или {"no_data": True}
+    """
+    s_id = str(id)
+    try:
+        res_json = json.loads(payload)
+    except Exception as e:
+        if LOGGING_IS_REQUIRED:
+            logging.error("Не удалось расшифровать json id: " + s_id, exc_info=e)
+        raise e
+    res_json = res_json[s_id]
+    if "success" in res_json and res_json["success"] and "data" in res_json:
+        res_json = res_json["data"]
+        game_data = copy_required_data(res_json, ["genres", "categories"])
+        game_data["price"] = None
+        if res_json["is_free"]:
+            game_data["price"] = 0
+        else:
+            if "price_overview" in res_json:
+                game_data["price"] = res_json["price_overview"]["final"] // 100
+            else:
+                if LOGGING_IS_REQUIRED:
+                    logging.warning("No price for id: " + s_id)
     else:
+        game_data = {"no_data": True}
         if LOGGING_IS_REQUIRED:
-            logging.warning("No details for id: " + s_id + ". Status code = " + str(res.status_code))
+            logging.warning("No details for id: " + s_id)
 
     if (("genres" not in game_data) or (game_data["genres"]) == [])\
             and (("categories" not in game_data) or (game_data["categories"]) == [])\
@@ -93,13 +182,192 @@ def get_details(id: int, max_attempts:int=5) -> dict:
 
     return game_data
 
-def get_tags_data(client, ids: set[int], seen_tags:set=None, new_tags:set=None, no_tags_ids:set=None,
-                  max_tag_order:int=None):
+def get_details(id: int, max_attempts:int=HTTP_MAX_ATTEMPTS, country:str="ru", limiter=None,
+                use_cache:bool=RESPONSE_CACHE_ENABLED, cache_only:bool=False) -> dict:
+    """
+    Возвращает жанры, категории и цену приложения
+    :param country: Код страны (цена в валюте этой страны)
+    :param limiter: Ограничитель частоты запросов (rate_control, используется только для запросов в сеть)
+    :param use_cache: Брать ли ответ из кэша ответов (и сохранять ли новые ответы в кэш)
+    :param cache_only: Не обращаться к api: если ответа нет в кэше (даже устаревшего), то возвращается None
+    :return: Словарь (см. parse_details) или None, если данные получить не удалось
+    """
+    from http_utils import http_get
+
+    s_id = str(id)
+    if use_cache or cache_only:
+        cache = get_response_cache()
+        payload = cache.get("appdetails", s_id, country, ignore_ttl=cache_only)
+        if payload is not None:
+            return parse_details(id, payload)
+        if cache_only:
+            return None
+
+    res = http_get(STORE_API_URL + "appdetails", params={"appids": s_id, "cc": country}, max_attempts=max_attempts,
+                   endpoint="appdetails", limiter=limiter)
+    if res.status_code != 200:
+        if LOGGING_IS_REQUIRED:
+            logging.warning("No details for id: " + s_id + ". Status code = " + str(res.status_code))
+        return None
+
+    game_data = parse_details(id, res.text)
+    if use_cache:
+        cache.put("appdetails", s_id, country, res.text)
+    return game_data
+
+def get_prices(ids: Iterable[int], country: str = "ru", limiter=None, max_attempts: int = HTTP_MAX_ATTEMPTS) -> dict:
+    """
+    Получает цены сразу для нескольких приложений (appdetails с filters=price_overview)
+    :param ids: id приложений
+    :param country: Код страны
+    :param limiter: Ограничитель частоты запросов
+    :return: Словарь {id приложения: price_overview} (только приложения, у которых есть цена)
+    или None, если запрос не удался
+    """
+    from http_utils import http_get
+
+    s_ids = ",".join(str(id) for id in ids)
+    res = http_get(STORE_API_URL + "appdetails", params={"appids": s_ids, "filters": "price_overview", "cc": country},
+                   max_attempts=max_attempts, endpoint="appdetails_prices", limiter=limiter)
+    if res.status_code != 200:
+        if LOGGING_IS_REQUIRED:
+            logging.warning("No prices for ids: " + s_ids + ". Status code = " + str(res.status_code))
+        return None
+
+    prices = {}
+    for s_id, app_json in res.json().items():
+        # У бесплатных приложений и приложений без цены data - пустой список
+        if app_json.get("success") and isinstance(app_json.get("data"), dict) \
+                and "price_overview" in app_json["data"]:
+            prices[int(s_id)] = app_json["data"]["price_overview"]
+    return prices
+
+def get_paid_apps_ids(cursor:psycopg2.extensions.cursor) -> list[int]:
+    """
+    :return: id приложений, у которых в apps_prices есть ненулевая цена
+    """
+    cursor.execute(""" SELECT DISTINCT app_id FROM apps_prices WHERE price > 0 ORDER BY app_id """)
+    return [row[0] for row in cursor.fetchall()]
+
+def get_product_info_chunk(client, ids: list[int], timeout: float = PRODUCT_INFO_TIMEOUT,
+                           max_attempts: int = PRODUCT_INFO_MAX_ATTEMPTS, limiter=None) -> dict:
+    """
+    Запрашивает product info для части приложений, при ошибке или таймауте повторяет запрос
+    :param limiter: Ограничитель частоты запросов (rate_control). Ожидание перед каждой попыткой
+    :return: Словарь {id приложения: информация}
+    """
+    import gevent
+    from http_utils import get_backoff_delay
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if not client.logged_on:
+            # Соединение разорвано: запрос части повторяется после переподключения (SteamSession.relogin)
+            client.relogin()
+        if limiter is not None:
+            limiter.acquire(sleep=client.sleep)
+        start = time.perf_counter()
+        try:
+            with gevent.Timeout(timeout):
+                products_info = client.get_product_info(apps=ids, timeout=timeout)
+            if products_info is None:
+                raise TimeoutError("Нет ответа на запрос product info")
+            latency = time.perf_counter() - start
+            metrics.observe("cm_request_seconds", latency, endpoint="product_info")
+            metrics.inc("cm_requests", endpoint="product_info", status="ok")
+            if limiter is not None:
+                limiter.report(latency)
+            return products_info["apps"]
+        except (Exception, gevent.Timeout) as e:
+            metrics.inc("cm_requests", endpoint="product_info", status="error")
+            if limiter is not None:
+                limiter.report(time.perf_counter() - start, error=True)
+            if attempt >= max_attempts:
+                raise Exception("Не удалось получить product info") from e
+            metrics.inc("cm_retries", endpoint="product_info")
+            if LOGGING_IS_REQUIRED:
+                logging.warning("Попытка запроса product info: " + str(attempt) + ". " + repr(e))
+            client.sleep(get_backoff_delay(attempt))
+
+def get_products_info(client, ids: list[int], chunk_size: int = PRODUCT_INFO_CHUNK_SIZE,
+                      concurrency: int = PRODUCT_INFO_CONCURRENCY, failed_ids: set = None,
+                      use_cache: bool = RESPONSE_CACHE_ENABLED, cache_only: bool = False, limiter=None) -> dict:
+    """
+    Запрашивает product info частями по chunk_size приложений, до concurrency запросов одновременно
+    (через gevent, на одном подключении клиента)
+    :param limiter: Ограничитель частоты запросов (rate_control)
+    :param failed_ids: Множество, в которое добавляются id из частей, которые не удалось получить
+    :param use_cache: Брать ли ответы из кэша ответов (и сохранять ли новые ответы в кэш)
+    :param cache_only: Не обращаться к steam: id, которых нет в кэше, добавляются в failed_ids
+    :return: Словарь {id приложения: информация}
+    """
+    from gevent.pool import Pool
+
+    products_info = {}
+    ids = list(ids)
+
+    if use_cache or cache_only:
+        cache = get_response_cache()
+        missing_ids = []
+        for id in ids:
+            payload = cache.get("product_info", id, ignore_ttl=cache_only)
+            if payload is None:
+                missing_ids.append(id)
+                continue
+            # null - приложения не было в ответе steam
+            info = json.loads(payload)
+            if info is not None:
+                products_info[id] = info
+        ids = missing_ids
+        if cache_only:
+            if failed_ids is not None:
+                failed_ids.update(ids)
+            return products_info
+
+    chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+    def fetch(chunk):
+        try:
+            chunk_info = get_product_info_chunk(client, chunk, limiter=limiter)
+        except Exception as e:
+            if LOGGING_IS_REQUIRED:
+                logging.error("Не удалось получить product info для " + str(chunk), exc_info=e)
+            if failed_ids is not None:
+                failed_ids.update(chunk)
+            return {}
+        if use_cache:
+            for id in chunk:
+                cache.put("product_info", id, "", json.dumps(chunk_info.get(id), ensure_ascii=False, default=str))
+        return chunk_info
+
+    for chunk_info in Pool(concurrency).imap_unordered(fetch, chunks):
+        products_info.update(chunk_info)
+    return products_info
+
+def get_tags_data(client, ids: list[int], seen_tags:set=None, new_tags:set=None, no_tags_ids:set=None,
+                  max_tag_order:int=None, failed_ids:set=None, chunk_size:int=PRODUCT_INFO_CHUNK_SIZE,
+                  concurrency:int=PRODUCT_INFO_CONCURRENCY, use_cache:bool=RESPONSE_CACHE_ENABLED,
+                  cache_only:bool=False, limiter=None):
+    """
+    Возвращает метки приложений
+    :param failed_ids: Множество, в которое добавляются id, по которым не удалось получить ответ
+    (они не попадают в no_tags_ids)
+    :param chunk_size: Количество приложений в одном запросе product info
+    :param concurrency: Количество одновременных запросов product info
+    :param use_cache: Использовать ли кэш ответов
+    :param cache_only: Брать данные только из кэша (client не используется)
+    :param limiter: Ограничитель частоты запросов product info (rate_control)
+    :return: Список [(id приложения, id метки, порядок метки)]
+    """
     res = []
 
-    products_info = client.get_product_info(apps=ids)
-    products_info = products_info["apps"]
+    if failed_ids is None:
+        failed_ids = set()
+    products_info = get_products_info(client, ids, chunk_size, concurrency, failed_ids, use_cache, cache_only, limiter)
     for id in ids:
+        if id in failed_ids:
+            continue
         if id in products_info and "common" in products_info[id] and "store_tags" in products_info[id]["common"] \
                 and len(products_info[id]["common"]["store_tags"]) > 0:
             tags_info = products_info[id]["common"]["store_tags"]
@@ -120,47 +388,19 @@ def get_tags_data(client, ids: set[int], seen_tags:set=None, new_tags:set=None,
                 no_tags_ids.add(id)
     return res
 
-def get_loaded_details_ids(conn:psycopg2.extensions.connection=None, cursor:psycopg2.extensions.cursor=None) -> set:
-    """
-    :param conn: Подключение
-    :param cursor: Курсор
-    :return: Множество id, для которых не нужно получать информацию по ценам, категория и жанрам
-    """
-
-    if not conn:
-        db_params = get_db_params()
-        conn = psycopg2.connect(**db_params)
-
-    if not cursor:
-        cursor = conn.cursor()
-
-    try:
-        cursor.execute(
-        """SELECT DISTINCT apps_categories.app_id FROM apps_categories
-        UNION
-        SELECT DISTINCT apps_genres.app_id FROM apps_genres
-        UNION
-        SELECT DISTINCT apps_prices.app_id FROM apps_prices
-        UNION
-        SELECT apps.id FROM apps
-        WHERE apps.no_data_details = True"""
-        )
-    except Exception as e:
-        if conn:
-            cursor.close()
-            conn.close()
-        raise e
-
-    return set([row[0] for row in cursor.fetchall()])
+def _fetch_id_set(cursor: psycopg2.extensions.cursor, query: str, params: tuple = None) -> "IdSet":
+    # numpy (id_set) импортируется только при необходимости, чтобы действия без загрузчиков запускались быстрее
+    from id_set import fetch_id_set
+    return fetch_id_set(cursor, query, params)
 
 def get_seen_objects(table_name: str, conn:psycopg2.extensions.connection=None,
-                     cursor:psycopg2.extensions.cursor=None) -> set:
+                     cursor:psycopg2.extensions.cursor=None) -> "IdSet":
     """
     Возвращает id, которые уже записаны в таблицу
     :param table_name: Строка - название таблицы в postgres
     :param conn: Подключение
     :param cursor: Курсор
-    :return: Множество id, которые уже записаны в таблицу
+    :return: Множество (IdSet) id, которые уже записаны в таблицу
     """
 
     if not conn:
@@ -171,20 +411,20 @@ def get_seen_objects(table_name: str, conn:psycopg2.extensions.connection=None,
         cursor = conn.cursor()
 
     try:
-        cursor.execute(""" SELECT DISTINCT id from """ + table_name)
+        id_set = _fetch_id_set(cursor, """ SELECT DISTINCT id from """ + table_name)
     except Exception as e:
         if conn:
             cursor.close()
             conn.close()
         raise e
 
-    return set([row[0] for row in cursor.fetchall()])
+    return id_set
 
-def get_loaded_tags_id(conn:psycopg2.extensions.connection=None, cursor:psycopg2.extensions.cursor=None) -> set:
+def get_apps_ids(conn:psycopg2.extensions.connection=None, cursor:psycopg2.extensions.cursor=None) -> "IdSet":
     """
     :param conn: Подключение
     :param cursor: Курсор
-    :return: Множество id, для которых не нужно получать информацию по меткам
+    :return: Множество (IdSet) id приложений
     """
     if not conn:
         db_params = get_db_params()
@@ -194,78 +434,61 @@ def get_loaded_tags_id(conn:psycopg2.extensions.connection=None, cursor:psycopg2
         cursor = conn.cursor()
 
     try:
-        cursor.execute("""
-        SELECT DISTINCT app_id FROM apps_store_tags
-        UNION
-        SELECT id FROM apps
-        WHERE no_data_tags = True""")
+        id_set = _fetch_id_set(cursor, """ SELECT id from apps """)
     except Exception as e:
         if conn:
             cursor.close()
             conn.close()
         raise e
 
-    return set([row[0] for row in cursor.fetchall()])
+    return id_set
 
-def get_apps_ids(conn:psycopg2.extensions.connection=None, cursor:psycopg2.extensions.cursor=None) -> set:
+def get_named_tags(cursor:psycopg2.extensions.cursor, col_name:str) -> "IdSet":
     """
-    :param conn: Подключение
-    :param cursor: Курсор
-    :return: Множество id приложений
+    :param cursor
+    :param col_name
+    :return: Множество (IdSet) id меток, у которых есть значение в col_name
     """
-    if not conn:
-        db_params = get_db_params()
-        conn = psycopg2.connect(**db_params)
-
-    if not cursor:
-        cursor = conn.cursor()
-
     try:
-        cursor.execute(""" SELECT id from apps """)
+        id_set = _fetch_id_set(cursor, """ SELECT id from store_tags WHERE {0} <> '' """.format(col_name))
     except Exception as e:
-        if conn:
+        if cursor:
             cursor.close()
-            conn.close()
         raise e
 
-    return set([row[0] for row in cursor.fetchall()])
+    return id_set
 
-def get_named_tags(cursor:psycopg2.extensions.cursor, col_name:str) -> set:
+def prepare_unnamed_tags_search(cursor:psycopg2.extensions.cursor) -> None:
     """
-    :param cursor
-    :param col_name
-    :return: Множество id меток, у которых есть значение в col_name
+    Создает временную таблицу seen_apps (приложения, страницы которых уже просмотрены).
+    Поиск использует индекс apps_store_tags(tag_id, app_id) из schema.py
     """
-    try:
-        cursor.execute(""" SELECT id from store_tags WHERE {0} <> '' """.format(col_name))
-    except Exception as e:
-        if cursor:
-            cursor.close()
-        raise e
+    cursor.execute(""" CREATE TEMP TABLE IF NOT EXISTS seen_apps (app_id integer PRIMARY KEY) """)
 
-    return set([row[0] for row in cursor.fetchall()])
+def add_seen_apps(cursor:psycopg2.extensions.cursor, app_ids:Iterable[int]) -> None:
+    """
+    Добавляет приложения во временную таблицу seen_apps
+    """
+    execute_values(cursor, """ INSERT INTO seen_apps (app_id) VALUES %s ON CONFLICT DO NOTHING """,
+                   [(app_id,) for app_id in app_ids])
 
-def get_fetch_list_of_unnamed_tags_with_apps_id_ru(cursor:psycopg2.extensions.cursor, col_name:str, seen_apps:set) -> list:
+def get_fetch_list_of_unnamed_tags_with_apps_id_ru(cursor:psycopg2.extensions.cursor, col_name:str) -> list:
     """
-    Возвращает id меток без значения в col_name и приложений, у которых есть эти метки (по одному на каждую метку)
+    Возвращает id меток без значения в col_name и приложений, у которых есть эти метки (по одному на каждую метку).
+    Приложения из временной таблицы seen_apps не выбираются (см. prepare_unnamed_tags_search)
     :param cursor
     :param col_name
     :return: Список [(id метки, id приложения)]
     """
-    query_template = """
-            SELECT DISTINCT
-            store_tags.id,
-            (SELECT app_id FROM apps_store_tags WHERE apps_store_tags.tag_id = store_tags.id AND app_id NOT IN {1} LIMIT 1)
-            FROM
-            store_tags
-            WHERE {0} = '' or {0} is NULL
-        """
+    query = sql.SQL("""
+            SELECT DISTINCT ON (apps_store_tags.tag_id) apps_store_tags.tag_id, apps_store_tags.app_id
+            FROM store_tags
+            JOIN apps_store_tags ON apps_store_tags.tag_id = store_tags.id
+            WHERE (store_tags.{0} = '' OR store_tags.{0} IS NULL)
+                AND NOT EXISTS (SELECT 1 FROM seen_apps WHERE seen_apps.app_id = apps_store_tags.app_id)
+            ORDER BY apps_store_tags.tag_id, apps_store_tags.app_id
+        """).format(sql.Identifier(col_name))
     try:
-        if len(seen_apps) == 0:
-            query_template = query_template.replace("AND app_id NOT IN {1}", "")
-            query = query_template.format(col_name)
-        else:
-            query = query_template.format(col_name, seen_apps).replace("{", "(").replace("}", ")")
         cursor.execute(query)
     except Exception as e:
         if cursor:
@@ -274,21 +497,13 @@ def get_fetch_list_of_unnamed_tags_with_apps_id_ru(cursor:psycopg2.extensions.cu
 
     return cursor.fetchall()
 
-def insert_tag_name(cursor:psycopg2.extensions.cursor, tag_id: int, tag_name:str, col_name:str= "name") -> None:
+def insert_tag_names(cursor:psycopg2.extensions.cursor, tag_names:Iterable, col_name:str= "name",
+                     batch_size:int=DB_BATCH_SIZE) -> None:
     """
-    Вставляет name_ru для метки
-    :param tag_id
-    :param tag_name
+    Записывает названия меток одним запросом UPDATE ... FROM (VALUES ...) (на каждые batch_size меток)
+    :param tag_names: Пары (id метки, название)
     :param col_name: Название колонки, в которую нужно вставлять название
     """
-    cursor.execute(""" UPDATE store_tags SET {2}='{0}' WHERE id={1} """.format(tag_name, tag_id, col_name))
-
-
-
-
-
-
-
-
-
-    
+    query = sql.SQL(""" UPDATE store_tags SET {0} = data.name FROM (VALUES %s) AS data (id, name)
+                        WHERE store_tags.id = data.id """).format(sql.Identifier(col_name))
+    execute_values(cursor, query.as_string(cursor), list(tag_names), page_size=batch_size)
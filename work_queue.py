@@ -0,0 +1,52 @@
+from typing import Iterable
+
+from id_set import IdSet
+
+
+class WorkQueue:
+    """
+    Очередь id приложений для загрузки.
+    Список ожидающих id вычисляется один раз (в порядке возрастания id),
+    каждая следующая пачка начинается там, где закончилась предыдущая
+    """
+
+    def __init__(self, ids: Iterable[int], done: Iterable[int] = ()):
+        """
+        :param ids: Все id (IdSet или любая последовательность)
+        :param done: id, которые уже загружены (пропускаются)
+        """
+        pending = ids if isinstance(ids, IdSet) else IdSet(ids)
+        pending = pending - (done if isinstance(done, IdSet) else IdSet(done))
+        # Массив numpy (8 байт на id) вместо списка объектов int
+        self._pending = pending.to_array()
+        self._position = 0
+
+    def next_batch(self, size: int) -> list[int]:
+        """
+        :param size: Размер пачки
+        :return: Следующие size id (пустой список, если очередь закончилась)
+        """
+        batch = self._pending[self._position:self._position + size].tolist()
+        self._position += len(batch)
+        return batch
+
+    @property
+    def total(self) -> int:
+        return len(self._pending)
+
+    @property
+    def completed(self) -> int:
+        """
+        Количество id, которые уже выданы из очереди
+        """
+        return self._position
+
+    @property
+    def pending(self) -> int:
+        """
+        Количество id, которые еще не выданы из очереди
+        """
+        return len(self._pending) - self._position
+
+    def __len__(self) -> int:
+        return self.pending